@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""
+Compares CPU time of parsing whole pages with parsing only the parts selected
+by a scraper's SoupStrainer.
+
+Usage:
+    python benchmarks/strainer_parse.py --save <scraper> <ad|listing|pager> <url>
+    python benchmarks/strainer_parse.py [--repeat N]
+
+Pages are kept in benchmarks/pages/<scraper>/<kind>/ and every page is
+benchmarked against the strainer of its kind. sample.html of every scraper and
+kind is shipped with the repository - it holds the nodes the scraper parses
+within typical page chrome. Pages saved with --save stay local.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import CVScraper, CVbankasScraper, CVmarketScraper, GeraPraktikaScraper
+
+SCRAPERS = {cls.__name__: cls for cls in (CVScraper, CVbankasScraper, CVmarketScraper, GeraPraktikaScraper)}
+KINDS = ('ad', 'listing', 'pager')
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+def save_page(scraper_name, kind, url):
+    directory = os.path.join(PAGES_DIR, scraper_name, kind)
+    os.makedirs(directory, exist_ok=True)
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(request, timeout=60) as resp:
+        text = resp.read().decode('utf-8', errors='replace')
+    path = os.path.join(directory, hashlib.sha1(url.encode()).hexdigest() + '.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"Saved {url} to {path}")
+
+
+def cpu_time(fn, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) / repeat
+
+
+def benchmark(repeat):
+    for scraper_name, cls in SCRAPERS.items():
+        parser = cls(None, None)
+        for kind in KINDS:
+            strainer = getattr(parser, f"{kind}_strainer")
+            directory = os.path.join(PAGES_DIR, scraper_name, kind)
+            if strainer is None or not os.path.isdir(directory):
+                continue
+            for file_name in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+                    page = f.read()
+                full = cpu_time(lambda: parser.make_soup(page), repeat)
+                strained = cpu_time(lambda: parser.make_soup(page, strainer), repeat)
+                print(f"{scraper_name:20} {kind:8} {file_name[:12]} {len(page) // 1024:5} KiB  "
+                    f"full {full * 1000:7.2f} ms  strained {strained * 1000:7.2f} ms  "
+                    f"saved {(1 - strained / full) * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--save', nargs=3, metavar=('SCRAPER', 'KIND', 'URL'))
+    arg_parser.add_argument('--repeat', type=int, default=20)
+    args = arg_parser.parse_args()
+    if args.save:
+        scraper_name, kind, url = args.save
+        if scraper_name not in SCRAPERS or kind not in KINDS:
+            arg_parser.error(f"scraper must be one of {', '.join(SCRAPERS)} and kind one of {', '.join(KINDS)}")
+        save_page(scraper_name, kind, url)
+    else:
+        benchmark(args.repeat)
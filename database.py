@@ -1,12 +1,25 @@
 #!/usr/bin/python3
 
+import os
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import re
 import socket
 import threading
+import time
 import traceback
-from queue import SimpleQueue
+from queue import SimpleQueue, Empty
 from logger import Logger
+from metrics import metrics
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    # Connection remembering which prepared statements exist in its session.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
 
 
 class Database(threading.Thread):
@@ -18,35 +31,50 @@ class Database(threading.Thread):
         self.host = 'localhost'
         self.password = 'ridikelis'
         self.port = '5432'
+        # Requests from scrapers, Locator and Scoreboard take their own connection
+        # from the pool, so reads don't wait for the writer or for each other.
+        # Pool keeps min_connections open - about as many as are used at once
+        # by the writer, five scrapers, Locator and Scoreboard.
+        self.min_connections = 8
+        self.max_connections = 12
+        self.pool = None
+        # Connection and cursor reserved for the queue writer thread.
         self.connection = None
         self.cursor = None
-        self.dict_cursor = None
         self.running = False
         self.connected = False
         self.queue = SimpleQueue()
+        # Writer collects queued rows into batches and writes every batch in a
+        # single transaction. Batch is written when it reaches batch_size rows
+        # or when batch_window seconds have passed since its first row.
+        self.batch_size = 500
+        self.batch_window = 2
+        # Referenced tables are written first so that foreign keys are satisfied.
+        self.table_order = ['addresses', 'job_listings']
+        self.listeners = []
+        # Server side prepared statements - {name: statement}. Each pooled
+        # connection prepares a statement the first time it executes it.
+        self.prepared_statements = {}
+        # Numbered SQL files (i.e. 002_add_column.sql) applied in order on connect.
+        # Applied versions are recorded in 'schema_migrations' table.
+        self.migrations_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
         self.logger = Logger('Database')
-        self.lock = threading.Lock()
 
     def connect(self):
         self.logger.info(f"Trying to connect to {self.host}")
-        args = f"dbname='{self.dbname}' user='{self.user}' host='{self.host}' password='{self.password}' port={self.port}"
-        "'connect_timeout'=3 'keepalives'=1 'keepalives_idle'=5 'keepalives_interval'=2 'keepalives_count'=2"
         try:
-            self.connection = psycopg2.connect(args)
-            # This allows connection to raise psycopg2.OperationalError when database becomes unavailable
-            # during transaction. Othervise, transaction hangs on cursor operations.
-            # FOR UNIX LIKE MACHINES ONLY
-            try:
-                s = socket.fromfd(self.connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 6)
-                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 2)
-                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 2)
-                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, 5000)
-            except AttributeError:
-                pass
+            self.pool = psycopg2.pool.ThreadedConnectionPool(self.min_connections, self.max_connections,
+                dbname=self.dbname, user=self.user, host=self.host, password=self.password, port=self.port,
+                connection_factory=PreparingConnection,
+                connect_timeout=3, keepalives=1, keepalives_idle=5, keepalives_interval=2, keepalives_count=2)
+            self.connection = self.__get_connection()
             self.cursor = self.connection.cursor()
-            self.dict_cursor = self.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            if not self.migrate():
+                # Writes and reads would fail against an outdated schema. Writer
+                # keeps draining its queue, dropping rows until restarted.
+                self.logger.error(f"Database schema is not up to date. Database - {self.dbname} won't be used.")
+                self.pool.closeall()
+                return
             self.connected = True
             self.logger.info(f"Successfully connected to database - {self.dbname}")
         except psycopg2.OperationalError as e:
@@ -56,95 +84,282 @@ class Database(threading.Thread):
                 threading.Timer(10, self.connect).start()
             self.logger.error(f"Unable to connect to database - {e}")
 
+    def migrate(self):
+        # Applies migrations which are not applied yet, each in its own transaction.
+        # Returns False if schema couldn't be brought up to date.
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version int4 NOT NULL PRIMARY KEY, "
+            "name text NOT NULL, applied timestamp NOT NULL DEFAULT now());")
+        self.cursor.execute("SELECT version FROM schema_migrations;")
+        applied = {row[0] for row in self.cursor.fetchall()}
+        self.connection.commit()
+        migrations = []
+        for file_name in os.listdir(self.migrations_dir):
+            match = re.match(r'(\d+)_.*\.sql$', file_name)
+            if match:
+                migrations.append((int(match.group(1)), file_name))
+        for version, file_name in sorted(migrations):
+            if version in applied:
+                continue
+            with open(os.path.join(self.migrations_dir, file_name), encoding='utf-8') as f:
+                statements = f.read()
+            try:
+                self.cursor.execute(statements)
+                self.cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                    (version, file_name))
+                self.connection.commit()
+                self.logger.info(f"Applied migration {file_name}.")
+            except (psycopg2.ProgrammingError, psycopg2.IntegrityError, psycopg2.DataError,
+                    psycopg2.InternalError, psycopg2.NotSupportedError):
+                self.connection.rollback()
+                self.logger.error(f"Unable to apply migration {file_name} - {traceback.format_exc()}")
+                # Later migrations may depend on this one.
+                return False
+        return True
+
+    def __get_connection(self):
+        connection = self.pool.getconn()
+        # This allows connection to raise psycopg2.OperationalError when database becomes unavailable
+        # during transaction. Othervise, transaction hangs on cursor operations.
+        # FOR UNIX LIKE MACHINES ONLY
+        try:
+            s = socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 6)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 2)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 2)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, 5000)
+            s.close()
+        except AttributeError:
+            pass
+        return connection
+
+    def __put_connection(self, connection, broken=False):
+        try:
+            self.pool.putconn(connection, close=broken)
+        except psycopg2.pool.PoolError:
+            pass
+
+    def __reset_writer_connection(self):
+        # Called after the writer connection failed - next batch uses a fresh one.
+        self.__put_connection(self.connection, broken=True)
+        try:
+            self.connection = self.__get_connection()
+            self.cursor = self.connection.cursor()
+        except (psycopg2.OperationalError, psycopg2.pool.PoolError) as e:
+            self.logger.error(f"Unable to reconnect database writer - {e}")
+            self.connected = False
+            if self.running:
+                threading.Timer(10, self.connect).start()
+
     def disconnect(self):
         if self.connected:
+            self.connected = False
             self.cursor.close()
-            self.connection.close()
+            self.pool.closeall()
             self.logger.warning(f"Disconnected from database - {self.dbname}")
 
-    def insert_into(self, table, data):
-        columns = data.keys()
-        values = data.values()
-        insert_que = f"INSERT INTO {table} (%s) VALUES %s"
-        with self.lock:
+    def upsert(self, table, data, conflict_column='url', stale_after='2 weeks'):
+        # Queues row to be inserted, or to replace an existing row with the same
+        # conflict_column value if that row was last written more than
+        # stale_after ago. Database decides which one in a single statement.
+        self.queue.put((table, data, (conflict_column, stale_after)))
+
+    def prepare(self, name, statement):
+        # Registers statement (using $1, $2... placeholders) to be executed
+        # with request_prepared(). Planned once per connection by the server.
+        self.prepared_statements[name] = statement
+
+    def request_prepared(self, name, params, fetch=True, dict_cursor=False):
+        placeholders = ', '.join(['%s'] * len(params))
+        req = f"EXECUTE {name} ({placeholders});" if params else f"EXECUTE {name};"
+        return self.request(req, params, fetch, dict_cursor, prepared=name)
+
+    def request(self, req, params=None, fetch=True, dict_cursor=False, prepared=None):
+        if not self.connected:
+            return None
+        try:
+            connection = self.__get_connection()
+        except (psycopg2.OperationalError, psycopg2.pool.PoolError) as e:
+            self.logger.error(f"Unable to get database connection - {e}")
+            return None
+        broken = False
+        try:
+            cursor_factory = psycopg2.extras.RealDictCursor if dict_cursor else None
+            with connection.cursor(cursor_factory=cursor_factory) as cursor:
+                if prepared:
+                    if prepared not in connection.prepared:
+                        cursor.execute(f"PREPARE {prepared} AS {self.prepared_statements[prepared]}")
+                        connection.prepared.add(prepared)
+                cursor.execute(req, params)
+                data = cursor.fetchall() if fetch else None
+            # Reads are committed as well so that pooled connections are never
+            # left idle in transaction.
+            connection.commit()
+            return data
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self.logger.error(f"Unable to execute the request - {traceback.format_exc()}")
+            broken = True
+        except (psycopg2.ProgrammingError, psycopg2.IntegrityError, psycopg2.DataError) as e:
+            self.logger.error(f"Unable to execute the request - {traceback.format_exc()}")
+            connection.rollback()
+        finally:
+            self.__put_connection(connection, broken)
+
+    def __next_batch(self):
+        batch = []
+        item = self.queue.get()
+        deadline = time.monotonic() + self.batch_window
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
             try:
-                self.cursor.execute(insert_que, (psycopg2.extensions.AsIs(','.join(columns)), tuple(values)))
-                self.connection.commit()
-            except (psycopg2.OperationalError, TypeError) as e:
-                self.logger.error(f"Unable to add data to database - {traceback.format_exc()}")
-                self.cursor.execute("ROLLBACK")
-                self.connection.commit()
-            except psycopg2.errors.UniqueViolation as e:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                break
+        else:
+            # None is put into the queue by stop().
+            self.running = False
+        metrics.set('db_queue_depth', self.queue.qsize())
+        return batch
+
+    def __group_batch(self, batch):
+        # Groups rows by table, operation and set of columns so that every
+        # group can be written with a single multi-row statement.
+        groups = {}
+        for table, data, *upsert in batch:
+            if not data:
+                continue
+            key = (table, tuple(data.keys()), upsert[0] if upsert else None)
+            groups.setdefault(key, []).append(data)
+        order = {table: i for i, table in enumerate(self.table_order)}
+        return sorted(groups.items(), key=lambda g: order.get(g[0][0], len(order)))
+
+    def __upsert_clause(self, table, columns, upsert):
+        conflict_column, stale_after = upsert
+        update_columns = [c for c in columns if c not in (conflict_column, 'entered', 'updated')]
+        assignments = [f"{c}=EXCLUDED.{c}" for c in update_columns]
+        # Original insertion time is kept, time of this scrape goes to 'updated'.
+        assignments.append("updated=EXCLUDED.entered")
+        stale_after = self.cursor.mogrify("%s", (stale_after,)).decode()
+        return (f" ON CONFLICT ({conflict_column}) DO UPDATE SET {', '.join(assignments)} "
+            f"WHERE COALESCE({table}.updated, {table}.entered) < now() - {stale_after}::interval")
+
+    def __upserted_row(self, row, entered):
+        # Row as stored - updated rows keep their original 'entered' time and
+        # time of this write goes to 'updated'.
+        if entered == row['entered']:
+            return row
+        return dict(row, entered=entered, updated=row['entered'])
+
+    def __insert_rows(self, table, columns, rows, upsert=None):
+        # Returns rows which were actually written.
+        insert_que = f"INSERT INTO {table} ({','.join(columns)}) VALUES %s"
+        if upsert:
+            insert_que += self.__upsert_clause(table, columns, upsert)
+            # Rows which were not stale enough to be updated are not returned.
+            insert_que += f" RETURNING {upsert[0]}, entered"
+            # Single statement can't touch the same row twice - keep the latest.
+            rows = list({row[upsert[0]]: row for row in rows}.values())
+        values = [tuple(row[c] for c in columns) for row in rows]
+        self.cursor.execute("SAVEPOINT batch_group")
+        try:
+            returned = psycopg2.extras.execute_values(self.cursor, insert_que, values,
+                page_size=len(values), fetch=bool(upsert))
+            self.cursor.execute("RELEASE SAVEPOINT batch_group")
+            if upsert:
+                entered = dict(returned)
+                return [self.__upserted_row(row, entered[row[upsert[0]]])
+                    for row in rows if row[upsert[0]] in entered]
+            return rows
+        except (psycopg2.IntegrityError, psycopg2.DataError):
+            self.cursor.execute("ROLLBACK TO SAVEPOINT batch_group")
+        # Some row in the group is invalid. Insert rows one by one so that
+        # only failing rows are left out.
+        written = []
+        for row, value in zip(rows, values):
+            self.cursor.execute("SAVEPOINT batch_row")
+            try:
+                self.cursor.execute(insert_que, (value,))
+                returned = self.cursor.fetchone() if upsert else None
+                self.cursor.execute("RELEASE SAVEPOINT batch_row")
+                if not upsert:
+                    written.append(row)
+                elif returned:
+                    written.append(self.__upserted_row(row, returned[1]))
+            except psycopg2.errors.UniqueViolation:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT batch_row")
                 self.logger.warning(f"Data already exists in a database and will not be inserted.")
-                self.cursor.execute("ROLLBACK")
-                self.connection.commit()
-            except (psycopg2.errors.NumericValueOutOfRange, psycopg2.errors.ForeignKeyViolation) as e:
+            except (psycopg2.IntegrityError, psycopg2.DataError):
+                self.cursor.execute("ROLLBACK TO SAVEPOINT batch_row")
                 self.logger.error(f"Unable to add data to database - {traceback.format_exc()}")
-                self.cursor.execute("ROLLBACK")
-                self.connection.commit()
+        return written
 
-    def update_row(self, table, primary_key, data):
-        req = f"UPDATE {table} SET "
-        for k, v in data.items():
-            if k != primary_key:
-                if isinstance(v, int) or isinstance(v, float):
-                    req += f"{k}={v},"
-                else:
-                    req += f"{k}='{v}',"
-        req = req[:-1] + ' '
-        # ADD LOCK MAYBE
-        req += f"WHERE {primary_key}='{data[primary_key]}';"
-        self.request(req, fetch=False)
-
-    def request(self, req, fetch=True, dict_cursor=False):
-        if self.connected:
-            with self.lock:
+    def add_listener(self, callback):
+        # Callback is called as callback(table, rows) from the writer thread
+        # after a batch containing rows for the table was committed. Upserted
+        # rows are passed as stored, with 'entered' and 'updated' times.
+        self.listeners.append(callback)
+
+    def __notify_listeners(self, written):
+        for table, rows in written.items():
+            for callback in self.listeners:
                 try:
-                    if dict_cursor:
-                        cursor = self.dict_cursor
-                    else:
-                        cursor = self.cursor
-                    cursor.execute(req)
-                    if fetch:
-                        data = cursor.fetchall()
-                        return data
-                    else:
-                        self.connection.commit()
-                except psycopg2.OperationalError as e:
-                    self.logger.error(f"Unable to execute the request - {traceback.format_exc()}")
-                    self.cursor.execute("ROLLBACK")
-                    self.connection.commit()
-                except psycopg2.ProgrammingError as e:
-                    self.logger.error(f"Unable to execute the request - {traceback.format_exc()}")
-                    self.cursor.execute("ROLLBACK")
-                    self.connection.commit()
-                except psycopg2.errors.InFailedSqlTransaction as e:
-                    self.logger.error(f"Unable to execute the request - {traceback.format_exc()}")
-                    self.cursor.execute("ROLLBACK")
-                    self.connection.commit()
+                    callback(table, rows)
+                except Exception:
+                    self.logger.error(f"Database listener failed - {traceback.format_exc()}")
+
+    def write_batch(self, batch, retry=True):
+        groups = self.__group_batch(batch)
+        if not groups:
+            return
+        if not self.connected:
+            self.logger.error(f"Not connected to database. Batch of {len(batch)} rows is dropped.")
+            return
+        written = {}
+        started = time.monotonic()
+        try:
+            for (table, columns, upsert), rows in groups:
+                written_rows = self.__insert_rows(table, columns, rows, upsert)
+                written.setdefault(table, []).extend(written_rows)
+                self.logger.info(f"{len(written_rows)}/{len(rows)} rows {'upserted' if upsert else 'inserted'} into table {table}")
+            self.connection.commit()
+            metrics.observe('db_write_seconds', time.monotonic() - started)
+            for table, rows in written.items():
+                metrics.inc('db_rows_written_total', len(rows), table=table)
+            written_ok = True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.logger.error(f"Unable to write batch of {len(batch)} rows to database - {traceback.format_exc()}")
+            self.__reset_writer_connection()
+            written_ok = False
+        except (psycopg2.Error, TypeError):
+            # Transaction is aborted - it must be rolled back before the next batch.
+            self.logger.error(f"Unable to write batch of {len(batch)} rows to database - {traceback.format_exc()}")
+            self.connection.rollback()
+            return
+        if written_ok:
+            self.__notify_listeners(written)
+        elif retry:
+            # Connection failed - batch is written once more using a fresh one.
+            self.logger.warning(f"Retrying batch of {len(batch)} rows.")
+            self.write_batch(batch, retry=False)
 
     def stop(self):
-        while not self.queue.empty():
-            pass
+        # Writer flushes everything that is already queued before stopping.
         self.queue.put(None)
-        self.running = False
-        self.disconnect()
+        if threading.current_thread() is not self:
+            self.join()
 
     def run(self):
         self.running = True
         self.connect()
-        try:
-            while self.running:
-                table, data = self.queue.get()
-                if data:
-                    if table == 'job_listings':
-                        if data.get('entered'):
-                            self.insert_into(table, data)
-                            self.logger.info(f"Data inserted for table {table}")
-                        elif data.get('updated'):
-                            self.update_row(table, 'url', data)
-                    else:
-                        self.insert_into(table, data)
-                        self.logger.info(f"Data inserted for table {table}")
-        except Exception:
-            self.logger.error(f"UNKNOWN DATABASE ERROR OCCURRED:\n{traceback.format_exc()}\nDATA: {data}")
+        while self.running:
+            batch = self.__next_batch()
+            try:
+                self.write_batch(batch)
+            except Exception:
+                self.logger.error(f"UNKNOWN DATABASE ERROR OCCURRED:\n{traceback.format_exc()}\nDATA: {batch}")
+        self.disconnect()
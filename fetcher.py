@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+import asyncio
+import random
+import threading
+import time
+import aiohttp
+from urllib.parse import urlsplit
+from httpcache import Page
+from logger import Logger
+from ratelimit import HostLimiter
+
+try:
+    import brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class FetchError(Exception):
+    """
+    Raised when a page couldn't be fetched even after retrying.
+    """
+
+
+class Session:
+
+    def __init__(self, fetcher, name, client):
+        """
+        Initializes Session object - persistent pooled HTTP session owned by a
+        single scraper. Connections are kept alive and reused per host.
+        """
+        self.fetcher = fetcher
+        self.name = name
+        self.client = client
+
+    def submit(self, link):
+        return self.fetcher.submit(link, self.client)
+
+    def get(self, link):
+        return self.submit(link).result()
+
+
+class Fetcher(threading.Thread):
+
+    def __init__(self, max_connections=16, max_connections_per_host=4, host_limits=None, cache=None,
+            max_retries=4, backoff=1, max_backoff=60, report_interval=600):
+        """
+        Initializes Fetcher object - asyncio based HTTP engine shared by all scrapers.
+        Requests are executed on a single event loop running in this thread,
+        limited by a global and a per-host number of concurrent requests and by
+        an adaptive per-host request rate. Failed requests are retried with
+        jittered exponential backoff.
+        If HttpCache is provided, pages are revalidated with conditional requests.
+        """
+        super().__init__(daemon=True)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        # Optional per-host overrides, i.e. {'www.cvbankas.lt': 2}.
+        self.host_limits = host_limits or {}
+        self.cache = cache
+        self.loop = asyncio.new_event_loop()
+        self.global_semaphore = None
+        self.host_semaphores = {}
+        self.host_limiters = {}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.report_interval = report_interval
+        self.session = None
+        self.sessions = {}
+        self.running = False
+        self.ready = threading.Event()
+        self.logger = Logger('Fetcher')
+
+    async def __open(self):
+        self.global_semaphore = asyncio.Semaphore(self.max_connections)
+        self.session = await self.__create_client()
+        self.loop.create_task(self.__report_periodically())
+
+    async def __close(self):
+        for session in self.sessions.values():
+            await session.client.close()
+        await self.session.close()
+
+    async def __create_client(self, pool_size=100, pool_size_per_host=0, timeout=60, keepalive=30):
+        connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size_per_host,
+            keepalive_timeout=keepalive, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector,
+            timeout=aiohttp.ClientTimeout(total=timeout, connect=min(timeout, 15)),
+            headers={'Accept-Encoding': ACCEPT_ENCODING})
+
+    def open_session(self, name, pool_size=8, pool_size_per_host=4, timeout=60, keepalive=30):
+        # Returns persistent session for given name, creating it on first use.
+        self.ready.wait()
+        if name not in self.sessions:
+            client = asyncio.run_coroutine_threadsafe(self.__create_client(pool_size,
+                pool_size_per_host, timeout, keepalive), self.loop).result()
+            self.sessions[name] = Session(self, name, client)
+            self.logger.info(f"Opened session for {name} (pool size {pool_size}, timeout {timeout}s).")
+        return self.sessions[name]
+
+    def __host_semaphore(self, host):
+        # Only ever called from the event loop thread, so no lock is needed.
+        semaphore = self.host_semaphores.get(host)
+        if not semaphore:
+            limit = self.host_limits.get(host, self.max_connections_per_host)
+            semaphore = asyncio.Semaphore(limit)
+            self.host_semaphores[host] = semaphore
+        return semaphore
+
+    def __host_limiter(self, host):
+        limiter = self.host_limiters.get(host)
+        if not limiter:
+            limiter = HostLimiter(host)
+            self.host_limiters[host] = limiter
+        return limiter
+
+    def __retry_delay(self, attempt, retry_after=None):
+        # Full jitter keeps scrapers that failed together from retrying together.
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        return max(delay, retry_after or 0)
+
+    def __retry_after(self, resp):
+        try:
+            return min(self.max_backoff, float(resp.headers.get('Retry-After')))
+        except (TypeError, ValueError):
+            return None
+
+    async def fetch(self, link, client=None):
+        host = urlsplit(link).netloc
+        limiter = self.__host_limiter(host)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await limiter.acquire()
+            try:
+                page, latency = await self.__fetch_once(link, host, client or self.session)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError):
+                    retry_after = e.headers and self.__retry_after(e)
+                limiter.on_failure(retry_after)
+                if attempt == self.max_retries:
+                    raise FetchError(f"{link} failed after {attempt + 1} attempts - {e!r}") from e
+                limiter.stats['retried'] += 1
+                delay = self.__retry_delay(attempt, retry_after)
+                self.logger.warning(f"Request to {link} failed ({e!r}). Retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+            else:
+                limiter.on_success(latency, len(page))
+                return page
+
+    async def __fetch_once(self, link, host, client):
+        # Returns page and latency of the host. Latency is measured once the
+        # connection limits are acquired, so waiting for them isn't blamed on the host.
+        # Cache does file I/O, so it is used from executor threads, not from the loop.
+        headers = await self.loop.run_in_executor(None, self.cache.validators, link) if self.cache else {}
+        async with self.global_semaphore, self.__host_semaphore(host):
+            started = time.monotonic()
+            async with client.get(link, headers=headers) as resp:
+                if resp.status == 304:
+                    latency = time.monotonic() - started
+                    text = await self.loop.run_in_executor(None, self.cache.load, link)
+                    if text is not None:
+                        return Page(text, link, not_modified=True), latency
+                else:
+                    return await self.__read_page(link, resp, started)
+        # Cached body is gone - the first response and connection limits are released
+        # before the page is requested unconditionally, so the request can't wait on itself.
+        async with self.global_semaphore, self.__host_semaphore(host):
+            started = time.monotonic()
+            async with client.get(link) as resp:
+                return await self.__read_page(link, resp, started)
+
+    async def __read_page(self, link, resp, started):
+        self.__check_status(resp)
+        text = await resp.text()
+        latency = time.monotonic() - started
+        if self.cache and resp.status == 200:
+            await self.loop.run_in_executor(None, self.cache.store, link, text,
+                resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        return Page(text, link), latency
+
+    def __check_status(self, resp):
+        # Only throttling and server errors are worth retrying.
+        if resp.status == 429 or resp.status >= 500:
+            resp.raise_for_status()
+
+    def throughput(self):
+        # Returns statistics of every host requested so far.
+        return [limiter.throughput() for limiter in list(self.host_limiters.values())]
+
+    async def __report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            for stats in self.throughput():
+                self.logger.info(f"{stats['host']}: {stats['requests_per_second']} req/s, "
+                    f"{stats['bytes_per_second']} B/s, rate limit {stats['rate']} req/s, "
+                    f"avg latency {stats['avg_latency']}s, {stats['failed']} failed, "
+                    f"{stats['retried']} retried, {stats['throttled']} throttled.")
+
+    def submit(self, link, client=None):
+        # Schedules request on the event loop and returns concurrent.futures.Future
+        # which can be waited on from any scraper thread.
+        self.ready.wait()
+        return asyncio.run_coroutine_threadsafe(self.fetch(link, client), self.loop)
+
+    def get(self, link):
+        return self.submit(link).result()
+
+    def stop(self):
+        if self.running:
+            asyncio.run_coroutine_threadsafe(self.__close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if self.cache:
+                self.cache.close()
+            self.running = False
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.__open())
+        self.running = True
+        self.ready.set()
+        self.logger.info(f"Fetcher started with {self.max_connections} connections "
+            f"({self.max_connections_per_host} per host).")
+        self.loop.run_forever()
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from logger import Logger
+
+
+class Page(str):
+    """
+    Page text returned by the fetcher. Behaves as an ordinary string but also
+    remembers the link it was fetched from, whether the server reported it
+    as unchanged (304 Not Modified) since the last time it was requested and
+    data the page was parsed into, so it isn't parsed twice.
+    """
+
+    def __new__(cls, text, link=None, not_modified=False):
+        page = super().__new__(cls, text)
+        page.link = link
+        page.not_modified = not_modified
+        page.parsed = None
+        return page
+
+
+class HttpCache:
+
+    def __init__(self, directory='http_cache', max_size=256 * 1024 * 1024):
+        """
+        Initializes HttpCache object - on-disk cache of page bodies together with
+        their ETag/Last-Modified validators, used to make conditional requests.
+        Least recently used entries are evicted when the cache grows above max_size bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.entries = OrderedDict()
+        self.size = 0
+        self.unsaved_changes = 0
+        self.lock = threading.Lock()
+        self.logger = Logger('HttpCache')
+        os.makedirs(self.directory, exist_ok=True)
+        self.__load_index()
+
+    def __load_index(self):
+        try:
+            with open(self.index_file) as f:
+                for key, entry in json.load(f):
+                    if os.path.exists(self.__body_file(key)):
+                        self.entries[key] = entry
+                        self.size += entry['size']
+            self.logger.info(f"Loaded {len(self.entries)} cached pages ({self.size} bytes).")
+        except (FileNotFoundError, ValueError):
+            self.logger.warning(f"No valid cache index found in {self.directory}. Starting with empty cache.")
+        # Bodies stored after the index was last saved aren't tracked, so they
+        # would never be evicted - remove them.
+        for name in os.listdir(self.directory):
+            if name not in self.entries and not name.startswith('index.json'):
+                try:
+                    os.remove(self.__body_file(name))
+                except OSError:
+                    pass
+
+    def __save_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_file, self.index_file)
+        self.unsaved_changes = 0
+
+    def __key(self, link):
+        return hashlib.sha1(link.encode()).hexdigest()
+
+    def __body_file(self, key):
+        return os.path.join(self.directory, key)
+
+    def __evict(self):
+        while self.size > self.max_size and self.entries:
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry['size']
+            try:
+                os.remove(self.__body_file(key))
+            except FileNotFoundError:
+                pass
+
+    def validators(self, link):
+        # Returns conditional request headers for a cached link.
+        headers = {}
+        with self.lock:
+            entry = self.entries.get(self.__key(link))
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def load(self, link):
+        key = self.__key(link)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.__body_file(key), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                entry = self.entries.pop(key, None)
+                if entry:
+                    self.size -= entry['size']
+            return None
+
+    def store(self, link, text, etag=None, last_modified=None):
+        # Only pages with validators are worth caching - others can't be revalidated.
+        if not (etag or last_modified):
+            return
+        key = self.__key(link)
+        body = text.encode('utf-8')
+        with open(self.__body_file(key), 'wb') as f:
+            f.write(body)
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry:
+                self.size -= old_entry['size']
+            self.entries[key] = {'link': link, 'etag': etag, 'last_modified': last_modified, 'size': len(body)}
+            self.size += len(body)
+            self.__evict()
+            self.unsaved_changes += 1
+            if self.unsaved_changes >= 50:
+                self.__save_index()
+
+    def close(self):
+        with self.lock:
+            self.__save_index()
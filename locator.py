@@ -1,61 +1,211 @@
 #!/usr/bin/python3
 
-from geopy.distance import geodesic
+import threading
+import time
+import traceback
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import SimpleQueue
 from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 from logger import Logger
+from metrics import metrics
+
+
+class TTLCache:
+
+    MISSING = object()
+
+    def __init__(self, name, maxsize=10000, ttl=7 * 24 * 3600):
+        """
+        Initializes TTLCache object - thread safe LRU cache whose entries also expire
+        after ttl seconds.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc('locator_cache_requests_total', cache=self.name, result='hit')
+                return entry[0]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            metrics.inc('locator_cache_requests_total', cache=self.name, result='miss')
+            return default
+
+    def peek(self, key, default=MISSING):
+        # Like get(), but doesn't count as a cache request or refresh the entry.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Great-circle distance in km. Works element-wise on NumPy arrays.
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(a))
 
 
 class Locator:
 
     def __init__(self, db):
+        # Only requests to Nominatim are rate limited - distances are computed locally.
         self.geocoder = RateLimiter(Nominatim(user_agent='CVscraper').geocode, min_delay_seconds=1)
-        self.geodesic = RateLimiter(geodesic, min_delay_seconds=1)
         self.db = db
+        self.db.prepare('tg3_distances', "SELECT name, dist_to_tg3 FROM addresses WHERE name = ANY($1)")
+        self.reference_address = "Tuskulenu g. 3, Vilnius"
+        self.reference_coordinates = None
+        # Coordinates of addresses and their distances to the reference address.
+        # Filled from 'addresses' table on first use so that repeated addresses
+        # cost no database round trips.
+        self.coordinates = TTLCache('coordinates')
+        self.distances = TTLCache('distances')
+        self.warmed_up = False
+        self.warm_up_lock = threading.Lock()
+        # Addresses waiting for the geocoding worker and futures of their distances.
+        self.requests = SimpleQueue()
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
         self.logger = Logger('Locator')
+        self.worker = threading.Thread(target=self.__geocoding_worker, daemon=True)
+        self.worker.start()
         self.logger.info(f"Locator object created.")
 
-    def distance_between_addresses(self, addr1, addr2):
-        self.logger.info(f"Calculating distance between {addr1} and {addr2}.")
-        distance = None
-        cord_1 = self.__get_coordinates_from_address(addr1)
-        cord_2 = self.__get_coordinates_from_address(addr2)
-        if cord_1 != (0,0) or cord_2 != (0,0):
-            distance = round(self.geodesic(cord_1, cord_2).km, 3)
-        if distance:
-            self.logger.info(f"Distance between {addr1} and {addr2} is {distance}.")
-        else:
-            self.logger.warning(f"Distance between {addr1} and {addr2} COULDN'T BE CALCULATED!!!")
-        return distance
-
-    def TG3_distance(self, address):
-        req = f"SELECT dist_to_tg3 FROM addresses WHERE name='{address}';"
-        try:
-            tg3_dist = self.db.request(req)[0][0]
-        except (IndexError, TypeError):
-            self.logger.warning(f"{address} seems to not be in a database or something went wrong.")
-            tg3_dist = None
-        if not tg3_dist:
-            tg3_dist = self.distance_between_addresses(address, "Tuskulenu g. 3, Vilnius")
-            self.logger.info(f"Updating TG3 distance item in database of {address}")
-            req = f"UPDATE addresses SET dist_to_tg3={tg3_dist} WHERE name='{address}';"
-            self.db.request(req, fetch=False)
-        else:
-            self.logger.info(f"Found TG3 distance of {address} in the database - {tg3_dist}.")
-        return tg3_dist
+    def warm_up(self):
+        with self.warm_up_lock:
+            if self.warmed_up:
+                return
+            rows = self.db.request("SELECT name, lat, lon, dist_to_tg3 FROM addresses;")
+            if rows is None:
+                self.logger.warning(f"Unable to warm up address cache. Will retry later.")
+                return
+            for name, lat, lon, dist_to_tg3 in rows:
+                self.coordinates.put(name, (lat, lon))
+                if dist_to_tg3:
+                    self.distances.put(name, dist_to_tg3)
+            self.warmed_up = True
+            self.logger.info(f"Address cache warmed up with {len(rows)} addresses.")
+
+    def distances_from_reference(self, addresses):
+        # Calculates distances from the reference address to all given addresses at once.
+        # Distance is None for addresses that couldn't be located.
+        if not self.reference_coordinates or self.reference_coordinates == (0,0):
+            self.reference_coordinates = self.__get_coordinates_from_address(self.reference_address)
+        if not addresses:
+            return []
+        coordinates = np.array([self.__get_coordinates_from_address(a) for a in addresses], dtype=float)
+        ref_lat, ref_lon = (float(c) for c in self.reference_coordinates)
+        distances = np.round(haversine(ref_lat, ref_lon, coordinates[:, 0], coordinates[:, 1]), 3)
+        located = np.any(coordinates != 0, axis=1) & (self.reference_coordinates != (0,0))
+        return [float(d) if ok else None for d, ok in zip(distances, located)]
+
+    def TG3_distance_async(self, address):
+        # Returns concurrent.futures.Future of the distance to the reference address.
+        # Addresses which are not cached are handed to the geocoding worker. The same
+        # address requested again while it is being resolved shares the same future.
+        tg3_dist = self.distances.get(address)
+        if tg3_dist is not TTLCache.MISSING:
+            future = Future()
+            future.set_result(tg3_dist)
+            return future
+        with self.in_flight_lock:
+            future = self.in_flight.get(address)
+            if not future:
+                future = Future()
+                self.in_flight[address] = future
+                self.requests.put(address)
+        return future
+
+    def __geocoding_worker(self):
+        # Single worker resolves all queued addresses, so Nominatim is only ever
+        # accessed from this thread and each address is geocoded once.
+        while True:
+            addresses = [self.requests.get()]
+            while not self.requests.empty():
+                addresses.append(self.requests.get())
+            try:
+                distances = self.__calculate_TG3_distances(addresses)
+            except Exception as e:
+                self.logger.error(f"Unable to calculate TG3 distances - {traceback.format_exc()}")
+                distances = {}
+                error = e
+            for address in addresses:
+                with self.in_flight_lock:
+                    future = self.in_flight.pop(address)
+                if address in distances:
+                    future.set_result(distances[address])
+                else:
+                    future.set_exception(error)
+
+    def __calculate_TG3_distances(self, addresses):
+        self.warm_up()
+        result = {}
+        unknown = []
+        for address in addresses:
+            # Already counted as a miss by TG3_distance_async(), but may have been
+            # cached meanwhile by an earlier batch.
+            tg3_dist = self.distances.peek(address)
+            if tg3_dist is not TTLCache.MISSING:
+                result[address] = tg3_dist
+            else:
+                unknown.append(address)
+        if unknown and not self.warmed_up:
+            # Cache couldn't be filled - fall back to asking the database.
+            rows = self.db.request_prepared('tg3_distances', (unknown,)) or []
+            for name, tg3_dist in rows:
+                if tg3_dist:
+                    result[name] = tg3_dist
+                    self.distances.put(name, tg3_dist)
+            unknown = [a for a in unknown if a not in result]
+        if unknown:
+            self.logger.info(f"Calculating TG3 distance of {len(unknown)} addresses.")
+            calculated = dict(zip(unknown, self.distances_from_reference(unknown)))
+            result.update(calculated)
+            names = [a for a, d in calculated.items() if d is not None]
+            # Failed distances are not cached while the reference itself is unknown.
+            if self.reference_coordinates != (0,0):
+                for address, tg3_dist in calculated.items():
+                    self.distances.put(address, tg3_dist)
+            if names:
+                self.logger.info(f"Updating TG3 distance of {len(names)} addresses in database.")
+                req = ("UPDATE addresses SET dist_to_tg3 = v.dist FROM unnest(%s::text[], %s::float4[]) "
+                    "AS v(name, dist) WHERE addresses.name = v.name;")
+                self.db.request(req, (names, [calculated[a] for a in names]), fetch=False)
+        return result
 
     def __get_addr_from_db(self, addr):
         address = {}
-        req = f"SELECT EXISTS(SELECT 1 FROM addresses WHERE name='{addr}');"
-        try:
-            exists = self.db.request(req)[0][0]
-        except (IndexError, TypeError) as e:
-            self.logger.error(f"Problem querying {addr} from the database - {e}")
-            exists = None
-        if exists:
+        req = "SELECT * FROM addresses WHERE name=%s;"
+        address_db = self.db.request(req, (addr,))
+        if address_db is None:
+            self.logger.error(f"Problem querying {addr} from the database.")
+        elif address_db:
             self.logger.info(f"{addr} exists in a database.")
-            req = f"SELECT * FROM addresses WHERE name='{addr}';"
-            address_db = self.db.request(req)[0]
+            address_db = address_db[0]
             address['name'] = address_db[0]
             address['id_osm'] = address_db[1]
             address['lat'] = address_db[2]
@@ -64,16 +214,28 @@ class Locator:
         return address
 
     def __get_coordinates_from_address(self, address):
-        # First check if address already exists in a database.
+        # Reference address is resolved only once. A failed lookup of it, (0,0),
+        # is retried next time, so it is neither cached nor stored.
+        is_reference = address == self.reference_address
+        if is_reference and self.reference_coordinates and self.reference_coordinates != (0,0):
+            return self.reference_coordinates
+        coordinates = self.coordinates.get(address)
+        if coordinates is not TTLCache.MISSING and not (is_reference and coordinates == (0,0)):
+            return coordinates
+        # Then check if address already exists in a database (it may have been
+        # evicted from the cache).
         db_data = self.__get_addr_from_db(address)
-        if db_data:
+        if db_data and not (is_reference and (db_data['lat'], db_data['lon']) == (0,0)):
             latitude = db_data['lat']
             longitude = db_data['lon']
         else:
             # Check the OSM database.
             try:
                 self.logger.info(f"Trying to fetch {address} from OSM database.")
-                osm_data = self.geocoder(address).raw
+                with metrics.timer('locator_geocode_seconds'):
+                    location = self.geocoder(address)
+                metrics.inc('locator_geocodes_total', result='found' if location else 'not_found')
+                osm_data = location.raw
                 osm_data['name'] = address
                 latitude = osm_data['lat']
                 longitude = osm_data['lon']
@@ -81,13 +243,17 @@ class Locator:
                 self.__osm_data_to_db(osm_data)
             except AttributeError:
                 self.logger.error(f"Couldn't fetch {address} from OSM database.")
+                if is_reference:
+                    return (0,0)
                 osm_data = {}
                 osm_data['name'] = address
                 osm_data['lon'] = 0
                 osm_data['lat'] = 0
                 osm_data['place_id'] = 0
                 self.__osm_data_to_db(osm_data)
+                self.coordinates.put(address, (0,0))
                 return (0,0)
+        self.coordinates.put(address, (latitude, longitude))
         return (latitude, longitude)
 
     def __osm_data_to_db(self, osm_data):
@@ -1,43 +1,101 @@
 #!usr/bin/python3
 
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import threading
+from queue import SimpleQueue
+
+# Every log file is written by a single background listener. Loggers only put
+# records into the queue of their file, so logging never waits for disk or stderr.
+queue_handlers = {}
+queue_handlers_lock = threading.Lock()
+# Set in worker processes - queue through which records go to the main process.
+forward_queue = None
+
+
+class ForwardedRecordHandler(logging.Handler):
+    # Writes records received from worker processes with loggers of the main process.
+    def emit(self, record):
+        Logger(record.name).logger.handle(record)
+
+
+def listen_to_processes(context=multiprocessing):
+    # Returns queue for forward_to() of worker processes. Records put into it
+    # are written by the main process, so only it ever writes and rotates log files.
+    queue = context.Queue()
+    listener = logging.handlers.QueueListener(queue, ForwardedRecordHandler())
+    listener.start()
+    atexit.register(listener.stop)
+    return queue
+
+
+def forward_to(queue):
+    # Initializer of worker processes.
+    global forward_queue
+    forward_queue = queue
+
+
+def get_queue_handler(log_file, max_bytes=10 * 1024 * 1024, backup_count=5):
+    if multiprocessing.parent_process() is not None:
+        # Worker processes don't write log files themselves.
+        return logging.handlers.QueueHandler(forward_queue) if forward_queue else None
+    with queue_handlers_lock:
+        if log_file not in queue_handlers:
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
+            file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                backupCount=backup_count, encoding='utf-8')
+            stream_handler = logging.StreamHandler()
+            file_handler.setFormatter(formatter)
+            stream_handler.setFormatter(formatter)
+            queue = SimpleQueue()
+            listener = logging.handlers.QueueListener(queue, stream_handler, file_handler)
+            listener.start()
+            # Records still in the queue are written before the application exits.
+            atexit.register(listener.stop)
+            queue_handlers[log_file] = logging.handlers.QueueHandler(queue)
+        return queue_handlers[log_file]
 
 
 class Logger:
     def __init__(self, logger_name, log_file='application_events.log'):
         """
         Initializes Logger object used to log various events happening during the execution of the application.
+        Messages may be given with %-style arguments, i.e. debug("Job %s", job), in which case
+        they are only formatted if the level is enabled.
         """
         self.logger_name = logger_name
         self.log_file = log_file
-        self.file_handler = logging.FileHandler(self.log_file)
         self.logger = logging.getLogger(self.logger_name)
-        self.formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
-        self.stream_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
-        self.stream_handler = logging.StreamHandler()
-        self.file_handler.setFormatter(self.formatter)
-        self.stream_handler.setFormatter(self.stream_formatter)
-        if not (self.logger.hasHandlers()):
-            self.logger.addHandler(self.stream_handler)
-            self.logger.addHandler(self.file_handler)
+        if not self.logger.handlers:
+            handler = get_queue_handler(self.log_file)
+            if handler:
+                self.logger.addHandler(handler)
+                self.logger.propagate = False
         self.logger.setLevel(logging.INFO)
 
-    def info(self, msg):
+    def debug(self, msg, *args):
+        """
+        """
+        self.logger.debug(msg, *args)
+
+    def info(self, msg, *args):
         """
         """
-        self.logger.info(msg)
+        self.logger.info(msg, *args)
 
-    def warning(self, msg):
+    def warning(self, msg, *args):
         """
         """
-        self.logger.warning(msg)
+        self.logger.warning(msg, *args)
 
-    def error(self, msg):
+    def error(self, msg, *args):
         """
         """
-        self.logger.error(msg)
+        self.logger.error(msg, *args)
 
-    def exception(self, msg):
+    def exception(self, msg, *args):
         """
         """
-        self.logger.exception(msg)
+        self.logger.exception(msg, *args)
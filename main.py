@@ -1,12 +1,20 @@
 #!/usr/bin/python3
 
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from logger import Logger
+from logger import Logger, forward_to, listen_to_processes
 from scraper import *
 from database import Database
+from fetcher import Fetcher
+from httpcache import HttpCache
+from metrics import MetricsServer
 from scoreboard import Scoreboard
 
 logger = Logger("main")
+# Parse and score pages in worker processes spread over all CPU cores.
+USE_PROCESS_POOL = False
 
 def scrape_periodically(scrapers, period, sb):
     logger.info(f"Starting periodic scraping.")
@@ -26,12 +34,26 @@ def scrape_periodically(scrapers, period, sb):
         scraper.finished_scraping.clear()
 
 if __name__ == "__main__":
+    metrics_server = MetricsServer()
+    metrics_server.start()
     db = Database()
     db.start()
     sb = Scoreboard(db)
     locator = Locator(db)
-    scrapers = [CVScraper(db, locator), CVbankasScraper(db, locator),
-        CVonlineScraper(db, locator), CVmarketScraper(db, locator),
-            GeraPraktikaScraper(db, locator)]
+    cache = HttpCache()
+    # Index is otherwise saved only every 50 stores.
+    atexit.register(cache.close)
+    fetcher = Fetcher(cache=cache)
+    fetcher.start()
+    process_pool = None
+    if USE_PROCESS_POOL:
+        # Workers are spawned rather than forked since this process already runs threads.
+        # Their log records are written by this process.
+        context = multiprocessing.get_context('spawn')
+        process_pool = ProcessPoolExecutor(mp_context=context, initializer=forward_to,
+            initargs=(listen_to_processes(context),))
+    scrapers = [CVScraper(db, locator, fetcher, process_pool), CVbankasScraper(db, locator, fetcher, process_pool),
+        CVonlineScraper(db, locator, fetcher, process_pool), CVmarketScraper(db, locator, fetcher, process_pool),
+            GeraPraktikaScraper(db, locator, fetcher, process_pool)]
     scrape_periodically(scrapers, 28800, sb)
     sb.start()
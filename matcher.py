@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+import re
+
+
+class KeywordMatcher:
+
+    def __init__(self, keyword_map):
+        """
+        Initializes KeywordMatcher object - scores text against a keyword map
+        ({points: (keyword or tuple of alternative keywords, ...)}) in a single
+        pass using one compiled regular expression. Every keyword or tuple of
+        alternatives adds its points once if any of its keywords is found.
+        """
+        self.points = []
+        term_groups = {}
+        for points, keywords in keyword_map.items():
+            for keyword in keywords:
+                group = len(self.points)
+                self.points.append(points)
+                terms = keyword if isinstance(keyword, tuple) else (keyword,)
+                for term in terms:
+                    term_groups.setdefault(term, set()).add(group)
+        # Longest terms are tried first. Lookahead makes the match zero-width, so a
+        # match is attempted at every position and overlapping terms are found too.
+        # Only one term is reported per position, so each term also implies all
+        # shorter terms that are its prefixes (i.e. 'database' implies 'data').
+        terms = sorted(term_groups, key=len, reverse=True)
+        self.implied_groups = {}
+        for term in terms:
+            groups = set()
+            for other, other_groups in term_groups.items():
+                if term.startswith(other):
+                    groups |= other_groups
+            self.implied_groups[term] = frozenset(groups)
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(t) for t in terms) + '))')
+
+    def matched_groups(self, text):
+        groups = set()
+        for term in set(self.pattern.findall(text.lower())):
+            groups |= self.implied_groups[term]
+        return groups
+
+    def score(self, text):
+        if not text:
+            return 0
+        return sum(self.points[group] for group in self.matched_groups(text))
+
+    def score_many(self, texts):
+        return [self.score(text) for text in texts]
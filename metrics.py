@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import Logger
+
+
+class Histogram:
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        Initializes Histogram object - counts of observed values falling into
+        each bucket, together with their total count and sum.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        Initializes Metrics object - thread safe registry of counters, gauges and
+        histograms. Every metric is identified by its name and labels, i.e.
+        metrics.observe('scraper_stage_seconds', 0.4, site='www.cv.lt', stage='ad_fetch').
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def __key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.__key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self.__key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if not histogram:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def snapshot(self, **labels):
+        # Returns {(name, labels): value} of metrics having all given labels.
+        # Value of a histogram is (count, sum).
+        wanted = set(labels.items())
+        with self.lock:
+            values = {**self.counters, **self.gauges}
+            values.update({k: (h.count, h.sum) for k, h in self.histograms.items()})
+        return {k: v for k, v in values.items() if wanted <= set(k[1])}
+
+    def to_json(self):
+        def entry(key, **values):
+            return {'name': key[0], 'labels': dict(key[1]), **values}
+        with self.lock:
+            return json.dumps({
+                'counters': [entry(k, value=v) for k, v in self.counters.items()],
+                'gauges': [entry(k, value=v) for k, v in self.gauges.items()],
+                'histograms': [entry(k, count=h.count, sum=h.sum,
+                    buckets=dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts)))
+                    for k, h in self.histograms.items()]
+            }, default=str)
+
+    def to_prometheus(self):
+        def labels_text(labels, **extra):
+            labels = list(labels) + list(extra.items())
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({k[0] for k in metrics}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (n, labels), value in metrics.items():
+                        if n == name:
+                            lines.append(f"{name}{labels_text(labels)} {value}")
+            for name in sorted({k[0] for k in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), h in self.histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bucket, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{labels_text(labels, le=bucket)} {cumulative}")
+                    lines.append(f"{name}_sum{labels_text(labels)} {h.sum}")
+                    lines.append(f"{name}_count{labels_text(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+def summarize(before, after):
+    # Returns text describing how metrics changed between two snapshots.
+    lines = []
+    for (name, labels), value in sorted(after.items()):
+        previous = before.get((name, labels))
+        label_text = ", ".join(f"{k}={v}" for k, v in labels if k != 'site')
+        if isinstance(value, tuple):
+            count = value[0] - (previous[0] if previous else 0)
+            total = value[1] - (previous[1] if previous else 0)
+            if count:
+                lines.append(f"{name} {label_text}: {count} times, {total:.2f}s total, {total / count:.3f}s avg")
+        elif value != previous:
+            lines.append(f"{name} {label_text}: {value - (previous or 0)}")
+    return "\n".join(lines)
+
+
+# Registry shared by the whole application.
+metrics = Metrics()
+
+
+class MetricsServer(threading.Thread):
+
+    def __init__(self, registry=metrics, host='127.0.0.1', port=9100):
+        """
+        Initializes MetricsServer object - HTTP server exposing the registry in
+        Prometheus text format at /metrics and as JSON at /metrics.json.
+        """
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.logger = Logger('MetricsServer')
+
+    def run(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = registry.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.logger.error(f"Unable to serve metrics on {self.host}:{self.port} - {e}")
+            return
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
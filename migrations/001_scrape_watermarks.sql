@@ -0,0 +1,9 @@
+-- Per site and search query state of incremental scraping.
+CREATE TABLE IF NOT EXISTS scrape_watermarks (
+    site text NOT NULL,
+    query text NOT NULL,
+    newest_url text,
+    full_scan timestamp,
+    updated timestamp NOT NULL,
+    PRIMARY KEY (site, query)
+);
@@ -0,0 +1,9 @@
+-- Host of the job site a listing was scraped from, i.e. 'www.cv.lt'.
+ALTER TABLE job_listings ADD COLUMN site text;
+UPDATE job_listings SET site = substring(url from '^[a-z]+://([^/]+)');
+ALTER TABLE job_listings ALTER COLUMN site SET NOT NULL;
+
+-- Known urls of a site (UrlIndex) and new listings of a site.
+CREATE INDEX job_listings_site_entered_idx ON job_listings (site, entered);
+-- Best offers (Scoreboard).
+CREATE INDEX job_listings_combined_score_idx ON job_listings (combined_score DESC);
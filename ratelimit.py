@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+import asyncio
+import time
+
+
+class HostLimiter:
+
+    def __init__(self, host, rate=2, min_rate=0.2, max_rate=20, burst=4, slow_latency=5):
+        """
+        Initializes HostLimiter object - adaptive token bucket limiting requests per
+        second to a single host. Rate grows additively while the host responds fast and
+        is halved when it answers with 429/5xx, times out or responds slower than
+        slow_latency seconds (AIMD). Only used from the event loop thread.
+        """
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.slow_latency = slow_latency
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0
+        self.blocked_until = 0
+        self.started = time.monotonic()
+        self.stats = {'requests': 0, 'succeeded': 0, 'failed': 0, 'retried': 0, 'throttled': 0,
+            'bytes': 0, 'latency': 0.0}
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self, latency, size):
+        self.stats['requests'] += 1
+        self.stats['succeeded'] += 1
+        self.stats['bytes'] += size
+        self.stats['latency'] += latency
+        if latency > self.slow_latency:
+            self.decrease()
+        else:
+            # Additive increase - roughly one more request per second every ten requests.
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def on_failure(self, retry_after=None):
+        self.stats['requests'] += 1
+        self.stats['failed'] += 1
+        if retry_after:
+            self.stats['throttled'] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.decrease()
+
+    def decrease(self):
+        # Responses of requests sent before the last decrease don't count again.
+        now = time.monotonic()
+        if now - self.last_decrease > 1 / self.rate:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 1)
+            self.last_decrease = now
+
+    def throughput(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        succeeded = self.stats['succeeded']
+        return {'host': self.host, 'rate': round(self.rate, 2),
+            'requests_per_second': round(succeeded / elapsed, 3),
+            'bytes_per_second': round(self.stats['bytes'] / elapsed),
+            'avg_latency': round(self.stats['latency'] / succeeded, 3) if succeeded else None,
+            **self.stats}
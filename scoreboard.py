@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import heapq
 import json
 import threading
 from datetime import datetime, timedelta
@@ -16,40 +17,95 @@ class Scoreboard(threading.Thread):
         self.info_event = threading.Event()
         self.logger = Logger("Scoreboard")
         self.db_columns = "title, company, description_score, distance_score, combined_score, url"
+        # Best offers of all time are kept in memory, so reports don't query and
+        # sort the table. Rows are seeded once from the database and then updated
+        # with rows written by the database writer. Extra top_slack rows let
+        # offers drop out of top without seeding again.
+        self.top_size = 30
+        self.top_slack = 20
+        self.top = {}
+        # True while top holds every row of the table.
+        self.top_complete = False
+        self.seeded = False
+        self.top_lock = threading.Lock()
+        self.db.add_listener(self.on_rows_written)
+
+    def seed(self):
+        req = (f"SELECT {self.db_columns}, entered FROM job_listings ORDER BY "
+            f"combined_score DESC LIMIT %s;")
+        with self.top_lock:
+            offers = self.__get_offers(req, (self.top_size + self.top_slack,))
+            if offers is None:
+                self.logger.error("Unable to seed best offers from the database.")
+                return False
+            self.top = {offer['url']: dict(offer) for offer in offers}
+            self.top_complete = len(offers) < self.top_size + self.top_slack
+            self.seeded = True
+        self.logger.info(f"Seeded {len(offers)} best offers from the database.")
+        return True
+
+    def on_rows_written(self, table, rows):
+        if table != 'job_listings':
+            return
+        columns = self.db_columns.split(", ") + ['entered']
+        with self.top_lock:
+            if not self.seeded:
+                return
+            for row in rows:
+                self.__add_offer({c: row[c] for c in columns})
+
+    def __add_offer(self, offer):
+        # Rows outside of top never score higher than the lowest offer in top.
+        url, score = offer['url'], offer['combined_score']
+        lowest = min((o['combined_score'] for u, o in self.top.items() if u != url), default=None)
+        if self.top_complete or lowest is None or score >= lowest:
+            self.top[url] = offer
+            if len(self.top) > self.top_size + self.top_slack:
+                del self.top[min(self.top, key=lambda u: self.top[u]['combined_score'])]
+                self.top_complete = False
+        elif url in self.top:
+            # Updated offer fell below rows which are not in top.
+            del self.top[url]
+            if len(self.top) < self.top_size:
+                self.seeded = False
+
+    def __best(self, since=None, until=None, count=5):
+        # Returns up to count best offers entered in [since, until). Offers found
+        # in a period must score higher than the TOP 30th offer of all time.
+        if not self.seeded and not self.seed():
+            return None
+        with self.top_lock:
+            offers = list(self.top.values())
+        if since or until:
+            if len(offers) < self.top_size:
+                return []
+            threshold = heapq.nlargest(self.top_size, (o['combined_score'] for o in offers))[-1]
+            offers = [o for o in offers if o['combined_score'] > threshold
+                and (not since or o['entered'] >= since) and (not until or o['entered'] < until)]
+        best = heapq.nlargest(count, offers, key=lambda o: o['combined_score'])
+        return [{k: v for k, v in o.items() if k != 'entered'} for o in best]
 
     def todays_best(self):
         # Returns up to 5 best combined score job offers found during last 24 h.
         # Returns job offers that are at least TOP 30 (?) all time.
-        top_req = ("SELECT combined_score FROM job_listings ORDER BY "
-            "combined_score DESC OFFSET 29 LIMIT 1")
-        req = (f"SELECT {self.db_columns} FROM job_listings WHERE entered >= "
-            f"current_date::timestamp and entered < current_date::timestamp "
-            f"+ interval '1 Day' AND ({top_req}) < combined_score ORDER BY "
-            f"combined_score DESC LIMIT 5;")
-        self.logger.info("Trying to retrieve today's best offers from the database...")
-        return self.__get_offers(req)
+        self.logger.info("Retrieving today's best offers...")
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        return self.__best(today, today + timedelta(days=1))
 
     def top_offers(self):
         # Returns up to 5 best offers of all time.
-        req = f"SELECT {self.db_columns} FROM job_listings ORDER BY combined_score DESC LIMIT 5;"
-        self.logger.info("Trying to retrieve best offers OF ALL TIME from the database...")
-        return self.__get_offers(req)
+        self.logger.info("Retrieving best offers OF ALL TIME...")
+        return self.__best()
 
     def best_new_offers(self):
         # Returns best found new offer after job search.
         # Must be at least TOP 30 (?).
         if self.date_of_last_scrape:
-            top_req = ("SELECT combined_score FROM job_listings ORDER BY "
-                "combined_score DESC OFFSET 29 LIMIT 1")
-            req = (f"SELECT {self.db_columns} FROM job_listings WHERE entered >= "
-                f"'{self.date_of_last_scrape}'::timestamp "
-                f"AND ({top_req}) < combined_score ORDER BY "
-                f"combined_score DESC LIMIT 5;")
-            self.logger.info("Trying to retrieve best offers after scarping from the database...")
-            return self.__get_offers(req)
-
-    def __get_offers(self, req):
-        offers = self.db.request(req, dict_cursor=True)
+            self.logger.info("Retrieving best offers after scarping...")
+            return self.__best(self.date_of_last_scrape)
+
+    def __get_offers(self, req, params=None):
+        offers = self.db.request(req, params, dict_cursor=True)
         # Will convert database results to python dictionary.
         # Results contain datetime object that will be converted to str by
         # "default=str" parameter since datetime objects are not serializable
@@ -1,18 +1,61 @@
 #!/usr/bin/python3
 
-import requests
+import concurrent.futures
 import json
+import math
+import re
 import threading
+import time
 import traceback
-from bs4 import BeautifulSoup
-from datetime import datetime
+from collections import OrderedDict, deque
+from bs4 import BeautifulSoup, SoupStrainer
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from fetcher import FetchError
 from locator import Locator
 from logger import Logger
+from matcher import KeywordMatcher
+from metrics import metrics, summarize
+from urlindex import UrlIndex
+from workers import WorkerPool
+
+try:
+    import orjson
+
+    def json_loads(data):
+        # orjson doesn't accept str subclasses such as Page.
+        return orjson.loads(str(data))
+except ImportError:
+    json_loads = json.loads
+
+
+# Scraper instances used for parsing inside worker processes, one per scraper class.
+process_parsers = {}
+
+
+def get_process_parser(scraper_class):
+    parser = process_parsers.get(scraper_class)
+    if not parser:
+        # Parser doesn't need database, locator or fetcher - it only parses pages.
+        parser = scraper_class(None, None)
+        process_parsers[scraper_class] = parser
+    return parser
+
+
+def refine_listing_page(scraper_class, page):
+    # Runs in a worker process.
+    parser = get_process_parser(scraper_class)
+    return parser.refine_job_data(parser.parse_listing_page(page))
+
+
+def refine_job_ad_page(scraper_class, req, link):
+    # Runs in a worker process.
+    return get_process_parser(scraper_class).refine_job_ad_data(req, link)
 
 
 class Scraper(threading.Thread):
 
-    def __init__(self, db, locator):
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
         super().__init__()
         self.search_keywords = ['python', 'linux', 'server', 'postgres']
         self.description_keyword_map = {
@@ -23,54 +66,324 @@ class Scraper(threading.Thread):
             -100:(('c#', '.net'), 'php', 'javascript', '3+ years', '3 years'),
             -300:('windows', 'senior', '5+ years', '5 years')
         }
+        # True for sites whose search accepts several keywords at once (matching any of them).
+        self.combine_keywords = False
+        # True for sites whose search results are sorted newest first. Such sites are
+        # scraped incrementally - pages are walked only until already known ads are
+        # reached, and all pages are walked only once every full_scan_interval.
+        self.newest_first = False
+        self.full_scan_interval = timedelta(weeks=1)
+        self.keyword_matcher = KeywordMatcher(self.description_keyword_map)
+        # SoupStrainers limiting parsing of pagers, listing pages and job ad pages
+        # to the nodes that are actually used. None means the whole page is parsed.
+        self.pager_strainer = None
+        self.listing_strainer = None
+        self.ad_strainer = None
         self.reference_location = "Tuskulenu g. 3, Vilnius"
         self.time_to_scrape_event = threading.Event()
         self.finished_scraping = threading.Event()
         self.running = False
         self.db = db
         self.locator = locator
+        self.fetcher = fetcher
+        # Optional concurrent.futures.ProcessPoolExecutor. When set, CPU bound parsing
+        # and scoring of pages is done in worker processes instead of scraper threads.
+        self.process_pool = process_pool
+        self.session = None
+        self.pool_size = 8
+        self.pool_size_per_host = 4
+        self.request_timeout = 60
+        # Parsed results of recently fetched pages. Reused when the server
+        # reports that the page has not been modified since.
+        self.parsed_pages = OrderedDict()
+        self.max_parsed_pages = 5000
+        self.parsed_pages_lock = threading.Lock()
+        self.url_index = None
+        self.pending_jobs = []
+        self.pending_lock = threading.Lock()
+        # Stages of the scraping pipeline are connected by bounded buffers.
+        self.listing_window = 8
+        self.ad_queue_size = 50
+        self.ad_workers = 8
+        # Ad stage workers live for the lifetime of the scraper and are reused every cycle.
+        self.worker_pool = None
         self.failure_count = 0
-        self.threads = []
+
+    @property
+    def site(self):
+        # Host of the job site, stored with every job listing.
+        return urlsplit(self.base_link).netloc
+
+    def stage(self, stage):
+        # Times a stage of the scraping pipeline.
+        return metrics.timer('scraper_stage_seconds', site=self.site, stage=stage)
+
+    def get_session(self):
+        # Each scraper owns its own persistent pooled session so that
+        # connections to the job site are reused between requests.
+        if not self.session:
+            self.session = self.fetcher.open_session(self.name, self.pool_size,
+                self.pool_size_per_host, self.request_timeout)
+        return self.session
 
     def get_page_data(self, link):
         self.logger.info(f"Requesting link: {link}")
-        req = requests.get(link).text
+        req = self.get_session().get(link)
         self.logger.info(f"Requesting link: {link} - SUCCESS!!!")
         return req
 
-    def get_job_data(self, link):
-        if isinstance(link, str):
-            data = self.get_page_data(link)
-            data = json.loads(data)
-            return data
-        else:
-            job_data = []
-            for l in link:
-                data = self.get_page_data(l)
-                data = json.loads(data)
-                job_data.append(data)
-            return job_data
-
-    def refine_job_ad_data(self):
+    def parse_listing_page(self, page):
+        # Returns list of raw job entries found in a listing page that can be
+        # passed to refine_job_data().
+        return [self.parse_page(page, json_loads)]
+
+    def listing_entry_url(self, entry):
+        # Returns url of a raw listing entry, or None if entries are whole pages.
+        return None
+
+    def has_listing_entry_urls(self):
+        # Listing pages whose entries have urls are refined in this thread even
+        # when process pool is used, so that entries already seen under another
+        # keyword are dropped before refining. Job ad pages still go to the pool.
+        return type(self).listing_entry_url is not Scraper.listing_entry_url
+
+    def iter_jobs(self, keywords):
+        # Listing stage - refined jobs are yielded page by page as pages arrive.
+        # Entries already seen under another keyword are dropped before refining.
+        queries = self.plan_queries(keywords)
+        watermarks = self.load_watermarks() if self.newest_first else {}
+        full_scan_queries = []
+        for query in queries:
+            newest_url, full_scan = watermarks.get(query, (None, None))
+            if full_scan and full_scan > datetime.now() - self.full_scan_interval:
+                yield from self.iter_new_jobs(query, newest_url)
+            else:
+                full_scan_queries.append(query)
+        if not full_scan_queries:
+            return
+        incomplete = set()
+        yield from self.iter_all_jobs(full_scan_queries, incomplete)
+        if self.newest_first:
+            # Queries with pages that couldn't be fetched are fully scanned again next time.
+            for query in full_scan_queries:
+                if query not in incomplete:
+                    self.save_watermark(query, None, datetime.now())
+
+    def iter_all_jobs(self, queries, incomplete=None):
+        pages = self.iter_listing_pages(queries, incomplete)
+        if self.process_pool and not self.has_listing_entry_urls():
+            yield from self.iter_jobs_in_processes(pages)
+            return
+        seen_urls = set()
+        for page in pages:
+            with self.stage('refine'):
+                entries = []
+                for entry in self.parse_listing_page(page):
+                    url = self.listing_entry_url(entry)
+                    if url:
+                        if url in seen_urls:
+                            continue
+                        seen_urls.add(url)
+                    entries.append(entry)
+                jobs = self.refine_job_data(entries)
+            yield from jobs
+
+    def iter_new_jobs(self, query, newest_url):
+        # Walks pages of query one by one and stops at the first page holding the
+        # newest ad of the previous walk or only ads which are already known.
+        # Newest ad of this walk is stored only if the walk wasn't interrupted.
+        session = self.get_session()
+        try:
+            with self.stage('listing_fetch'):
+                page = session.get(self.build_first_page_link(query))
+            with self.stage('link_build'):
+                links = deque(self.build_page_links(query, page))
+            first_url = None
+            pages = 1
+            while True:
+                jobs = self.get_listing_page_jobs(page)
+                urls = [job['url'] for job in jobs]
+                first_url = first_url or (urls[0] if urls else None)
+                # Decided before jobs are scraped - scraped jobs become known.
+                done = (not links or not urls or newest_url in urls
+                    or all(url in self.url_index for url in urls))
+                yield from jobs
+                if done:
+                    break
+                with self.stage('listing_fetch'):
+                    page = session.get(links.popleft())
+                pages += 1
+        except FetchError as e:
+            self.logger.error(f"Unable to fetch {query} listing pages - {e}")
+            return
+        self.logger.info(f"Scanned {pages} pages of {query} until known ads were reached.")
+        self.save_watermark(query, first_url, None)
+
+    def get_listing_page_jobs(self, page):
+        with self.stage('refine'):
+            if self.process_pool and not self.has_listing_entry_urls():
+                return self.process_pool.submit(refine_listing_page, type(self), page).result()
+            return self.refine_job_data(self.parse_listing_page(page))
+
+    def load_watermarks(self):
+        # Returns {query: (newest_url, full_scan)} of this site.
+        req = "SELECT query, newest_url, full_scan FROM scrape_watermarks WHERE site = %s;"
+        rows = self.db.request(req, (self.site,))
+        if rows is None:
+            self.logger.error(f"Unable to load watermarks of {self.name}. All pages will be scraped.")
+            return {}
+        return {query: (newest_url, full_scan) for query, newest_url, full_scan in rows}
+
+    def save_watermark(self, query, newest_url, full_scan):
+        # Values which are None are left unchanged.
+        req = ("INSERT INTO scrape_watermarks (site, query, newest_url, full_scan, updated) "
+            "VALUES (%s, %s, %s, %s, now()) ON CONFLICT (site, query) DO UPDATE SET "
+            "newest_url = COALESCE(EXCLUDED.newest_url, scrape_watermarks.newest_url), "
+            "full_scan = COALESCE(EXCLUDED.full_scan, scrape_watermarks.full_scan), updated = now();")
+        self.db.request(req, (self.site, query, newest_url, full_scan), fetch=False)
+
+    def iter_jobs_in_processes(self, pages):
+        # Pages are parsed and refined by worker processes, keeping up to
+        # listing_window pages in work. Jobs are yielded in page order.
+        # Overlapping jobs are dropped later by iter_jobs_to_scrape().
+        futures = deque()
+        for page in pages:
+            futures.append(self.process_pool.submit(refine_listing_page, type(self), page))
+            if len(futures) >= self.listing_window:
+                with self.stage('refine'):
+                    jobs = futures.popleft().result()
+                yield from jobs
+        while futures:
+            with self.stage('refine'):
+                jobs = futures.popleft().result()
+            yield from jobs
+
+    def iter_jobs_to_scrape(self, jobs, stats):
+        # Deduplication stage - lets through only jobs which are new or outdated.
+        seen_urls = set()
+        for job in jobs:
+            with self.stage('dedup'):
+                if job['url'] in seen_urls:
+                    result = 'duplicate'
+                else:
+                    seen_urls.add(job['url'])
+                    result = 'fresh' if self.url_index.is_fresh(job['url']) else 'scraped'
+            metrics.inc('scraper_jobs_total', site=self.site, result=result)
+            if result in stats:
+                stats[result] += 1
+            if result == 'scraped':
+                yield job
+
+    def parse_page(self, page, parser, *args):
+        # Page is parsed only once, i.e. first listing page is used both for the
+        # number of pages and as data. Unchanged pages (answered with 304 Not
+        # Modified) are not parsed again either.
+        if page.parsed is not None:
+            return page.parsed
+        if page.not_modified:
+            with self.parsed_pages_lock:
+                data = self.parsed_pages.get(page.link)
+                if data is not None:
+                    self.parsed_pages.move_to_end(page.link)
+            if data is not None:
+                self.logger.info(f"{page.link} not modified since the last scrape. Reusing parsed data.")
+                page.parsed = data
+                return data
+        data = page.parsed = parser(page, *args)
+        with self.parsed_pages_lock:
+            self.parsed_pages[page.link] = data
+            if len(self.parsed_pages) > self.max_parsed_pages:
+                self.parsed_pages.popitem(last=False)
+        return data
+
+    def get_job_ad_data(self, link):
+        with self.stage('ad_fetch'):
+            req = self.get_page_data(link)
+        with self.stage('ad_parse'):
+            if self.process_pool:
+                return dict(self.parse_page(req, self.refine_job_ad_data_in_process, link))
+            return dict(self.parse_page(req, self.refine_job_ad_data, link))
+
+    def refine_job_ad_data_in_process(self, req, link):
+        # Only the page text travels to the worker process and the refined dict back.
+        return self.process_pool.submit(refine_job_ad_page, type(self), str(req), link).result()
+
+    def refine_job_ad_data(self, req, link):
         pass
 
     def refine_job_data(self):
         pass
 
-    def build_request_link(self, keywords, no_of_jobs=1):
-        links = []
-        for keyword in keywords:
-            link = self.base_search_link + self.key_word_req + keyword + self.page_size_req + '1'
-            no_of_jobs = str(self.get_number_of_ads(self.get_job_data(link)))
-            if int(no_of_jobs) < 100:
-                request_link = self.base_search_link + self.key_word_req + keyword + self.page_size_req + no_of_jobs
-                links.append(request_link)
-            else:
-                self.logger.error(f"To many job offers ({no_of_jobs} !!!) in the request {link}")
-        return links
+    def plan_queries(self, keywords):
+        # Returns search queries (keyword parts of the search link) for keywords.
+        # Sites which accept several keywords in one search are asked once for all
+        # of them, others once per keyword.
+        if self.combine_keywords:
+            return ["".join(self.key_word_req + keyword for keyword in keywords)]
+        return [self.key_word_req + keyword for keyword in keywords]
+
+    def build_page_link(self, query, page_no):
+        return (self.base_search_link + query + self.page_size_req + str(self.page_size)
+            + self.page_req + str(page_no))
+
+    def build_first_page_link(self, query):
+        return self.build_page_link(query, 1)
+
+    def build_page_links(self, query, first_page):
+        # Returns links of the remaining pages of query, based on the first page.
+        no_of_jobs = self.get_number_of_ads(self.parse_page(first_page, json_loads))
+        no_of_pages = math.ceil(no_of_jobs / self.page_size)
+        if no_of_pages > self.max_pages:
+            self.logger.warning(f"{no_of_jobs} job offers found in the request {first_page.link}. "
+                f"Only first {self.max_pages} pages will be scraped.")
+            no_of_pages = self.max_pages
+        return [self.build_page_link(query, i) for i in range(2, no_of_pages + 1)]
+
+    def iter_listing_pages(self, queries, incomplete=None):
+        # First pages of all queries are requested concurrently. Every first page is
+        # used as data and as soon as it arrives, remaining pages of its query are
+        # requested. Pages are yielded in the order they are downloaded.
+        # Queries of pages that couldn't be fetched are added to incomplete set.
+        session = self.get_session()
+        waiting = deque((self.build_first_page_link(query), query, True) for query in queries)
+        pending = {}
+        while waiting or pending:
+            while waiting and len(pending) < self.listing_window:
+                link, query, first = waiting.popleft()
+                self.logger.info(f"Requesting link: {link}")
+                future = session.submit(link)
+                # Timed when the request completes, not when this generator gets to it,
+                # so time the consumer spends blocked downstream isn't counted.
+                future.add_done_callback(self.__fetch_timer(time.monotonic()))
+                pending[future] = (link, query, first)
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                link, query, first = pending.pop(future)
+                try:
+                    page = future.result()
+                except Exception as e:
+                    self.logger.error(f"Unable to fetch {link} - {e}")
+                    if incomplete is not None:
+                        incomplete.add(query)
+                    continue
+                if first:
+                    with self.stage('link_build'):
+                        links = self.build_page_links(query, page)
+                    waiting.extend((l, query, False) for l in links)
+                yield page
+
+    def __fetch_timer(self, submitted):
+        def observe(future):
+            metrics.observe('scraper_stage_seconds', time.monotonic() - submitted,
+                site=self.site, stage='listing_fetch')
+        return observe
+
+    def make_soup(self, page, strainer=None):
+        # Only parts of the page matching strainer are parsed into the tree.
+        return BeautifulSoup(page, 'lxml', parse_only=strainer)
 
     def get_number_of_ads(self, page, f_class, s_class):
-        soup = BeautifulSoup(page, 'lxml')
+        soup = self.make_soup(page, self.pager_strainer)
         try:
             no_of_pages = int(soup.find(class_=f_class).find_all(s_class)[-1].text)
         except AttributeError:
@@ -106,130 +419,150 @@ class Scraper(threading.Thread):
         return j_type
 
     def calculate_job_description_score(self, description):
-        score = 0
-        if description:
-            description = description.lower()
-            for points, keywords in self.description_keyword_map.items():
-                for keyword in keywords:
-                    if isinstance(keyword, tuple):
-                        for k in keyword:
-                            if k in description:
-                                score += points
-                                break
-                    else:
-                        if keyword in description:
-                            score += points
-        return score
+        return self.keyword_matcher.score(description)
 
-    def calculate_distance_score(self, address):
+    def calculate_job_description_scores(self, descriptions):
+        return self.keyword_matcher.score_many(descriptions)
+
+    def distance_to_score(self, distance):
         # Distance score is calculated according to this formula:
         # score = 2.456497 + (203.8315 - 2.456497)/(1 + (x/3.988254)^4.54989)
         score = 0
-        if address:
-            #distance = self.locator.distance_between_addresses(self.reference_location, address)
-            distance = self.locator.TG3_distance(address)
-            if distance:
-                score = 2.456497 + (203.8315 - 2.456497)/(1 + (distance/3.988254)**4.54989)
-                score = round(score)
+        if distance:
+            score = 2.456497 + (203.8315 - 2.456497)/(1 + (distance/3.988254)**4.54989)
+            score = round(score)
         return score
 
-    def insert_job_to_database(self, data):
-        insert_time = datetime.now()
-        data['entered'] = insert_time
-        self.logger.info(f"Trying to insert {data['url']} to database.")
-        self.db.queue.put(('job_listings', data))
-
-    def update_job_in_database(self, data):
-        update_time = datetime.now()
-        data['updated'] = update_time
-        self.logger.info(f"Updating job {data['url']} in a database")
-        self.db.queue.put(('job_listings', data))
+    def save_job_to_database(self, data):
+        data['site'] = self.site
+        data['entered'] = datetime.now()
+        self.logger.info(f"Trying to save {data['url']} to database.")
+        with self.stage('db_enqueue'):
+            self.db.upsert('job_listings', data)
+        metrics.inc('scraper_jobs_total', site=self.site, result='saved')
 
-    def scrape_and_insert(self, job):
+    def scrape_and_save(self, job):
         try:
-            self.logger.info(f"Collecting data for new job {job['url']}.")
-            job_ad_data = self.refine_job_ad_data(job['url'])
+            self.logger.info(f"Collecting data for job {job['url']}.")
+            job_ad_data = self.get_job_ad_data(job['url'])
             job.update(job_ad_data)
-            self.logger.info(f"\n\nGathered job info - {job}\n\n")
-            self.insert_job_to_database(job)
+            address = job.get('address')
+            if address:
+                # Geocoding is done by Locator in the background. Job is saved
+                # once its distance is known, so scraping doesn't wait for it.
+                future = self.locator.TG3_distance_async(address)
+                started = time.monotonic()
+                future.add_done_callback(lambda f: metrics.observe('scraper_stage_seconds',
+                    time.monotonic() - started, site=self.site, stage='geocode'))
+                # Resolved by finish_job() once the job is handed to the database.
+                saved = concurrent.futures.Future()
+                with self.pending_lock:
+                    self.pending_jobs.append(saved)
+                future.add_done_callback(lambda f: self.finish_job(job, f, saved))
+            else:
+                job['distance_score'] = 0
+                self.finish_job(job)
+        except FetchError as e:
+            # Site not responding is not a failure of the scraper itself.
+            self.logger.error(f"Unable to fetch {job['url']} - {e}")
         except Exception:
-            self.failure_count += 1
-            self.logger.error(f"Unknown error occurred in {self.name}. Failure count {self.failure_count}.\n{traceback.format_exc()}\n")
-            if self.failure_count > 4:
-                self.finished_scraping.set()
-                self.running = False
-                self.logger.error(f"Failure count exceeded. Stopping {self.name}...")
-
-    def scrape_and_update(self, job):
+            self.register_failure()
+
+    def finish_job(self, job, distance_future=None, saved=None):
         try:
-            self.logger.info(f"Collecting data to update job info {job['url']}")
-            job_ad_data = self.refine_job_ad_data(job['url'])
-            job.update(job_ad_data)
-            self.logger.info(f"\n\nGathered job info - {job}\n\n")
-            self.update_job_in_database(job)
+            if distance_future:
+                job['distance_score'] = self.distance_to_score(distance_future.result())
+            job['combined_score'] = job['description_score'] + job['distance_score']
+            self.logger.debug("Gathered job info - %s", job)
+            self.save_job_to_database(job)
         except Exception:
-            self.failure_count += 1
-            self.logger.error(f"Unknown error occurred in {self.name}. Failure count {self.failure_count}.\n{traceback.format_exc()}\n")
-            if self.failure_count > 4:
-                self.finished_scraping.set()
-                self.running = False
-                self.logger.error(f"Failure count exceeded. Stopping {self.name}...")
-
-    def get_existing_job_listing_url(self):
-        req = f"SELECT url, entered<(now() - '2 Weeks'::interval) FROM job_listings WHERE url LIKE '{self.base_link}%';"
-        urls = self.db.request(req)
-        return urls
+            self.register_failure()
+        finally:
+            if saved:
+                saved.set_result(None)
+
+    def register_failure(self):
+        self.failure_count += 1
+        metrics.inc('scraper_failures_total', site=self.site)
+        self.logger.error(f"Unknown error occurred in {self.name}. Failure count {self.failure_count}.\n{traceback.format_exc()}\n")
+        if self.failure_count > 4:
+            self.finished_scraping.set()
+            self.running = False
+            self.logger.error(f"Failure count exceeded. Stopping {self.name}...")
+
+    def wait_for_pending_jobs(self):
+        # Waits until jobs waiting for their distance are handed to the database.
+        with self.pending_lock:
+            pending, self.pending_jobs = self.pending_jobs, []
+        if pending:
+            self.logger.info(f"Waiting for distances of {len(pending)} jobs...")
+            concurrent.futures.wait(pending)
+
+    def log_throughput(self):
+        for stats in self.fetcher.throughput():
+            if stats['host'] == self.site:
+                self.logger.info(f"{self.site} throughput: {stats['requests_per_second']} req/s, "
+                    f"rate limit {stats['rate']} req/s, avg latency {stats['avg_latency']}s, "
+                    f"{stats['failed']} failed, {stats['retried']} retried, {stats['throttled']} throttled.")
+
+    def stop(self):
+        # Finishes current cycle and stops the scraper together with its workers.
+        self.running = False
+        self.time_to_scrape_event.set()
+        self.join()
 
     def run(self):
         self.running = True
-        failure_count = 0
+        if not self.worker_pool:
+            self.worker_pool = WorkerPool(self.name, self.ad_workers, self.ad_queue_size)
         while self.running:
             self.time_to_scrape_event.wait()
-            links = self.build_request_link(self.search_keywords)
-            self.logger.info(f"Attempting to gather job data for {links}.")
-            jobs = self.get_job_data(links)
-            self.logger.info(f"Refining job data....")
-            ref_jobs = self.refine_job_data(jobs)
-            self.logger.info(f"Attempting to gather job ad data...")
-            existing_urls = self.get_existing_job_listing_url()
-            duplicate_jobs = []
-            update_jobs = []
-            for url in existing_urls:
-                for job in ref_jobs:
-                    if url[0] == job['url']:
-                        if url[1]:
-                            update_jobs.append(job)
-                        duplicate_jobs.append(job)
-                        break
-            self.logger.info(f"{len(duplicate_jobs)} duplicate ads found and {len(update_jobs)} to be updated...")
-            ref_jobs = [job for job in ref_jobs if job not in duplicate_jobs]
-            self.logger.info(f"{len(ref_jobs)} will be attempted to be scraped.")
-            for job in ref_jobs:
-                t = threading.Thread(target=self.scrape_and_insert, args=[job])
-                t.start()
-                self.threads.append(t)
-            for t in self.threads:
-                t.join()
-            self.logger.info(f"{len(update_jobs)} will be attempted to be updated.")
-            for job in update_jobs:
-                t = threading.Thread(target=self.scrape_and_update, args=[job])
-                t.start()
-                self.threads.append(t)
-            for t in self.threads:
-                t.join()
+            if not self.running:
+                break
+            self.logger.info(f"Attempting to gather job data for {self.search_keywords}.")
+            self.failure_count = 0
+            cycle_started = time.monotonic()
+            before = metrics.snapshot(site=self.site)
+            if not self.url_index:
+                self.url_index = UrlIndex(self.db, self.site)
+            if not self.url_index.loaded:
+                self.url_index.load()
+            # Jobs stream from listing pages through deduplication into the bounded
+            # queue of the worker pool. Workers scrape job ads and put scraped jobs
+            # to database queue. Submitting blocks while the queue is full.
+            stats = {'fresh': 0, 'scraped': 0}
+            try:
+                for job in self.iter_jobs_to_scrape(self.iter_jobs(self.search_keywords), stats):
+                    self.worker_pool.submit(self.scrape_and_save, job)
+            except Exception:
+                self.register_failure()
+            self.worker_pool.join()
+            self.wait_for_pending_jobs()
+            self.logger.info(f"{stats['fresh']} duplicate ads skipped and {stats['scraped']} ads scraped.")
+            self.log_throughput()
+            metrics.observe('scraper_cycle_seconds', time.monotonic() - cycle_started, site=self.site)
+            self.logger.info("Cycle summary of %s:\n%s", self.site, summarize(before, metrics.snapshot(site=self.site)))
             self.time_to_scrape_event.clear()
             self.finished_scraping.set()
+        self.worker_pool.shutdown()
+        self.logger.info(f"{self.name} stopped.")
 
 
 class CVScraper(Scraper):
 
-    def __init__(self, db, locator):
-        super().__init__(db, locator)
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
+        super().__init__(db, locator, fetcher, process_pool)
         self.name = 'CV.lt'
         self.base_link = "https://www.cv.lt"
-        self.base_search_link = "https://www.cv.lt/smvc/board/list/get?desired=false&handicapped=false&page=1&remote=false&sortField=ORDER_TIME"
+        self.base_search_link = "https://www.cv.lt/smvc/board/list/get?desired=false&handicapped=false&remote=false&sortField=ORDER_TIME"
         self.page_size_req = "&pageSize="
+        self.page_req = "&page="
+        self.page_size = 50
+        self.max_pages = 40
         self.key_word_req = "&texts="
+        self.combine_keywords = True
+        self.newest_first = True
+        self.ad_strainer = SoupStrainer(class_=["details", "content job-description"])
         self.logger = Logger(self.name)
         self.city_map = {
             1010: 'Vilnius',
@@ -295,7 +628,7 @@ class CVScraper(Scraper):
         }
 
     def get_number_of_ads(self, page):
-        no_of_jobs = page['searchResult']['rowCount'] + 1
+        no_of_jobs = page['searchResult']['rowCount']
         return no_of_jobs
 
     def refine_job_data(self, data):
@@ -315,9 +648,8 @@ class CVScraper(Scraper):
                 jobs.append(job_data)
         return jobs
 
-    def refine_job_ad_data(self, link):
-        req = self.get_page_data(link)
-        soup = BeautifulSoup(req, 'lxml')
+    def refine_job_ad_data(self, req, link):
+        soup = self.make_soup(req, self.ad_strainer)
         email_k_words = ('email', 'e-mail', 'el. paštas')
         phone_k_words = ('phone', 'telefonas')
         address_k_words = ('address', 'adresas')
@@ -372,15 +704,13 @@ class CVScraper(Scraper):
                         job_data['remote'] = False
         description = str(soup.find(class_='content job-description'))
         job_data['description_score'] = self.calculate_job_description_score(description)
-        job_data['distance_score'] = self.calculate_distance_score(job_data.get('address'))
-        job_data['combined_score'] = job_data['description_score'] + job_data['distance_score']
         return job_data
 
 
 class CVbankasScraper(Scraper):
 
-    def __init__(self, db, locator):
-        super().__init__(db, locator)
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
+        super().__init__(db, locator, fetcher, process_pool)
         self.name = 'cvbankas.lt'
         self.base_link = "https://www.cvbankas.lt"
         self.base_search_link = "https://www.cvbankas.lt/?"
@@ -388,28 +718,27 @@ class CVbankasScraper(Scraper):
         self.no_of_pages_req = "&page="
         self.page_line_f_class = "pages_ul_inner"
         self.page_line_s_class = "a"
+        self.pager_strainer = SoupStrainer(class_=self.page_line_f_class)
+        self.listing_strainer = SoupStrainer("a", class_="list_a can_visited list_a_has_logo")
         self.logger = Logger(self.name)
 
-    def build_request_link(self, keywords, no_of_pages=1):
+    def build_first_page_link(self, query):
+        return self.base_search_link + query
+
+    def build_page_links(self, query, first_page):
         links = []
-        for keyword in keywords:
-            link = self.base_search_link + self.key_word_req + keyword
-            self.logger.info(link)
-            links.append(link)
-            no_of_pages = self.get_number_of_ads(self.get_page_data(link), self.page_line_f_class, self.page_line_s_class)
-            for i in range (2, no_of_pages + 1):
-                page_link = link + self.no_of_pages_req + str(i)
-                links.append(page_link)
+        no_of_pages = self.get_number_of_ads(first_page, self.page_line_f_class, self.page_line_s_class)
+        for i in range (2, no_of_pages + 1):
+            page_link = first_page.link + self.no_of_pages_req + str(i)
+            links.append(page_link)
         return links
 
-    def get_job_data(self, links):
-        all_jobs = []
-        for link in links:
-            req = self.get_page_data(link)
-            soup = BeautifulSoup(req, 'lxml')
-            jobs = soup.find_all("a", class_="list_a can_visited list_a_has_logo")
-            all_jobs += jobs
-        return all_jobs
+    def parse_listing_page(self, req):
+        soup = self.make_soup(req, self.listing_strainer)
+        return soup.find_all("a", class_="list_a can_visited list_a_has_logo")
+
+    def listing_entry_url(self, entry):
+        return entry.get('href')
 
     def refine_job_data(self, data):
         jobs = []
@@ -433,9 +762,9 @@ class CVbankasScraper(Scraper):
             jobs.append(job_data)
         return jobs
 
-    def refine_job_ad_data(self, link):
-        req = self.get_page_data(link)
-        soup = BeautifulSoup(req, 'lxml')
+    def refine_job_ad_data(self, req, link):
+        # Needed nodes are matched by different attributes, so the whole page is parsed.
+        soup = self.make_soup(req)
         job_data = {}
         try:
             salType_str = soup.find(class_="salary_calculation").text
@@ -464,20 +793,23 @@ class CVbankasScraper(Scraper):
             pass
         description = str(soup.find(itemprop="description"))
         job_data['description_score'] = self.calculate_job_description_score(description)
-        job_data['distance_score'] = self.calculate_distance_score(job_data.get('address'))
-        job_data['combined_score'] = job_data['description_score'] + job_data['distance_score']
         return job_data
 
 
 class CVonlineScraper(Scraper):
 
-    def __init__(self, db, locator):
-        super().__init__(db, locator)
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
+        super().__init__(db, locator, fetcher, process_pool)
         self.name = 'cvonline.lt'
         self.base_link = "https://www.cvonline.lt"
-        self.base_search_link = "https://www.cvonline.lt/api/v1/vacancies-service/search?&offset=0&isHourlySalary=false&isRemoteWork=false&lang=lt"
+        self.base_search_link = "https://www.cvonline.lt/api/v1/vacancies-service/search?&isHourlySalary=false&isRemoteWork=false&lang=lt"
         self.page_size_req = "&limit="
+        self.page_req = "&offset="
+        self.page_size = 50
+        self.max_pages = 40
         self.key_word_req = "&keywords[]="
+        self.combine_keywords = True
+        self.page_json_pattern = re.compile(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', re.DOTALL)
         self.logger = Logger(self.name)
         self.city_map = {
             540: 'Vilnius',
@@ -489,6 +821,10 @@ class CVonlineScraper(Scraper):
         no_of_jobs = page['total']
         return no_of_jobs
 
+    def build_page_link(self, query, page_no):
+        # cvonline.lt pages by offset of the first result.
+        return super().build_page_link(query, (page_no - 1) * self.page_size)
+
     def refine_job_data(self, data):
         jobs = []
         for datum in data:
@@ -513,13 +849,25 @@ class CVonlineScraper(Scraper):
                 jobs.append(job_data)
         return jobs
 
-    def refine_job_ad_data(self, link):
-        req = self.get_page_data(link)
+    def extract_page_json(self, req, link):
+        # Embedded JSON is cut straight out of the raw page. Page is parsed
+        # with BeautifulSoup only if the markup around it has changed.
+        match = self.page_json_pattern.search(req)
+        if match:
+            try:
+                return json_loads(match.group(1))
+            except ValueError:
+                self.logger.warning(f"Unable to decode embedded JSON of {link} directly. Parsing the page.")
+        else:
+            self.logger.warning(f"Embedded JSON not found in {link} directly. Parsing the page.")
         soup = BeautifulSoup(req, 'lxml')
         soup = str(soup.find(type="application/json"))
         soup = soup.replace('</script>', '')
         soup = soup.replace('<script id="__NEXT_DATA__" type="application/json">', '')
-        soup = json.loads(soup)
+        return json.loads(soup)
+
+    def refine_job_ad_data(self, req, link):
+        soup = self.extract_page_json(req, link)
         job_data = {}
         id_ = link.split('/')[5]
         salType_str = str(soup['props']['initialReduxState']['intl']['messages']['vacancy.highlights.form.salary'])
@@ -539,49 +887,51 @@ class CVonlineScraper(Scraper):
         for k_word in keyword_data:
             description += f"{k_word['value']}, "
         job_data['description_score'] = self.calculate_job_description_score(description)
-        job_data['distance_score'] = self.calculate_distance_score(job_data.get('address'))
-        job_data['combined_score'] = job_data['description_score'] + job_data['distance_score']
         return job_data
 
 
 class CVmarketScraper(Scraper):
 
-    def __init__(self, db, locator):
-        super().__init__(db, locator)
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
+        super().__init__(db, locator, fetcher, process_pool)
         self.name = 'cvmarket.lt'
         self.base_link = "https://www.cvmarket.lt"
         self.base_search_link = "https://www.cvmarket.lt/joboffers.php?_track=index_click_job_search&op=search&search_location=landingpage&ga_track=homepage"
         self.key_word_req = "&search[keyword]="
         self.no_of_pages_req = "&start="
+        self.pager_strainer = SoupStrainer(class_="pager_xs pagination")
+        self.listing_strainer = SoupStrainer(class_="f_job_row2")
+        self.ad_strainer = SoupStrainer(class_=["job-details-table", "label label-yellow", "col-md-8"])
         self.logger = Logger(self.name)
 
     def get_number_of_ads(self, page):
-        soup = BeautifulSoup(page, 'lxml')
+        soup = self.make_soup(page, self.pager_strainer)
         try:
             no_of_pages = int(soup.find(class_="pager_xs pagination").find_all("li", class_="")[-1].text)
         except AttributeError:
             no_of_pages = 1
         return no_of_pages
 
-    def build_request_link(self, keywords, no_of_pages=1):
+    def build_first_page_link(self, query):
+        return self.base_search_link + query
+
+    def build_page_links(self, query, first_page):
         links = []
-        for keyword in keywords:
-            link = self.base_search_link + self.key_word_req + keyword
-            links.append(link)
-            no_of_pages = self.get_number_of_ads(self.get_page_data(link))
-            for i in range (2, no_of_pages + 1):
-                page_link = link + self.no_of_pages_req + str((i*30) - 30)
-                links.append(page_link)
+        no_of_pages = self.get_number_of_ads(first_page)
+        for i in range (2, no_of_pages + 1):
+            page_link = first_page.link + self.no_of_pages_req + str((i*30) - 30)
+            links.append(page_link)
         return links
 
-    def get_job_data(self, links):
-        all_jobs = []
-        for link in links:
-            req = self.get_page_data(link)
-            soup = BeautifulSoup(req, 'lxml')
-            jobs = soup.find_all(class_="f_job_row2")
-            all_jobs += jobs
-        return all_jobs
+    def parse_listing_page(self, req):
+        soup = self.make_soup(req, self.listing_strainer)
+        return soup.find_all(class_="f_job_row2")
+
+    def listing_entry_url(self, entry):
+        try:
+            return self.base_link + entry.find(class_="f_job_title main_job_link limited-lines")['href']
+        except (TypeError, KeyError):
+            return None
 
     def refine_job_data(self, data):
         jobs = []
@@ -603,9 +953,8 @@ class CVmarketScraper(Scraper):
             jobs.append(job_data)
         return jobs
 
-    def refine_job_ad_data(self, link):
-        req = self.get_page_data(link)
-        soup = BeautifulSoup(req, 'lxml')
+    def refine_job_ad_data(self, req, link):
+        soup = self.make_soup(req, self.ad_strainer)
         job_data = {}
         try:
             details = str(soup.find(class_="job-details-table").find_all(class_="jobdetails_value"))
@@ -619,15 +968,13 @@ class CVmarketScraper(Scraper):
             job_data['remote'] = False
         description = str(soup.find(class_="col-md-8"))
         job_data['description_score'] = self.calculate_job_description_score(description)
-        job_data['distance_score'] = self.calculate_distance_score(job_data.get('address'))
-        job_data['combined_score'] = job_data['description_score'] + job_data['distance_score']
         return job_data
 
 
 class GeraPraktikaScraper(Scraper):
 
-    def __init__(self, db, locator):
-        super().__init__(db, locator)
+    def __init__(self, db, locator, fetcher=None, process_pool=None):
+        super().__init__(db, locator, fetcher, process_pool)
         self.name = 'gerapraktika.lt'
         self.base_link = "https://www.gerapraktika.lt"
         self.base_search_link = "https://www.gerapraktika.lt/praktikos-skelbimai/p0?"
@@ -635,28 +982,32 @@ class GeraPraktikaScraper(Scraper):
         self.no_of_pages_req = "/p"
         self.page_line_f_class = "pager"
         self.page_line_s_class = "invisible_pager_button"
+        self.pager_strainer = SoupStrainer(class_=self.page_line_f_class)
+        self.listing_strainer = SoupStrainer(class_="announcement")
+        self.ad_strainer = SoupStrainer(class_=["box_info", "company_description"])
         self.logger = Logger(self.name)
 
-    def build_request_link(self, keywords, no_of_pages=1):
+    def build_first_page_link(self, query):
+        return self.base_search_link + query
+
+    def build_page_links(self, query, first_page):
         links = []
-        for keyword in keywords:
-            link = self.base_search_link + self.key_word_req + keyword
-            links.append(link)
-            no_of_pages = self.get_number_of_ads(self.get_page_data(link), self.page_line_f_class, self.page_line_s_class)
-            for i in range (2, no_of_pages + 1):
-                page_tag = f"/p{i*20-20}?"
-                page_link = link.replace("/p0?", page_tag)
-                links.append(page_link)
+        no_of_pages = self.get_number_of_ads(first_page, self.page_line_f_class, self.page_line_s_class)
+        for i in range (2, no_of_pages + 1):
+            page_tag = f"/p{i*20-20}?"
+            page_link = first_page.link.replace("/p0?", page_tag)
+            links.append(page_link)
         return links
 
-    def get_job_data(self, links):
-        all_jobs = []
-        for link in links:
-            req = self.get_page_data(link)
-            soup = BeautifulSoup(req, 'lxml')
-            jobs = soup.find_all(class_="announcement")
-            all_jobs += jobs
-        return all_jobs
+    def parse_listing_page(self, req):
+        soup = self.make_soup(req, self.listing_strainer)
+        return soup.find_all(class_="announcement")
+
+    def listing_entry_url(self, entry):
+        try:
+            return self.base_link + entry.find(class_="company_title")['href']
+        except (TypeError, KeyError):
+            return None
 
     def refine_job_data(self, data):
         jobs = []
@@ -677,10 +1028,8 @@ class GeraPraktikaScraper(Scraper):
             jobs.append(job_data)
         return jobs
 
-    def refine_job_ad_data(self, link):
-        req = self.get_page_data(link)
-        soup = BeautifulSoup(req, 'lxml')
-        description = soup.find(class_="content job-description")
+    def refine_job_ad_data(self, req, link):
+        soup = self.make_soup(req, self.ad_strainer)
         job_data = {}
         address = str(soup.find(class_="box_info").find_all('div')[1].text).strip()
         if address:
@@ -694,6 +1043,4 @@ class GeraPraktikaScraper(Scraper):
             job_data['link'] = None
         description = str(soup.find(class_="company_description"))
         job_data['description_score'] = self.calculate_job_description_score(description)
-        job_data['distance_score'] = self.calculate_distance_score(job_data.get('address'))
-        job_data['combined_score'] = job_data['description_score'] + job_data['distance_score']
         return job_data
@@ -0,0 +1,59 @@
+from httpcache import HttpCache, Page
+
+
+def test_page_is_str_with_link():
+    page = Page("text", "https://a", not_modified=True)
+    assert page == "text" and page.link == "https://a" and page.not_modified
+
+
+def test_stores_only_pages_with_validators(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store("https://a", "body")
+    assert cache.load("https://a") is None
+    cache.store("https://a", "body", etag='"1"', last_modified="Mon")
+    assert cache.load("https://a") == "body"
+    assert cache.validators("https://a") == {'If-None-Match': '"1"', 'If-Modified-Since': "Mon"}
+    assert cache.validators("https://b") == {}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = HttpCache(str(tmp_path), max_size=25)
+    for link in ("https://a", "https://b"):
+        cache.store(link, "x" * 10, etag="e")
+    # Loading makes 'a' most recently used, so 'b' is evicted first.
+    cache.load("https://a")
+    cache.store("https://c", "x" * 10, etag="e")
+    assert cache.load("https://b") is None
+    assert cache.load("https://a") == "x" * 10
+    assert cache.load("https://c") == "x" * 10
+    assert cache.size == 20
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_replacing_page_updates_size(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store("https://a", "x" * 10, etag="1")
+    cache.store("https://a", "x" * 4, etag="2")
+    assert cache.size == 4
+    assert cache.validators("https://a") == {'If-None-Match': "2"}
+
+
+def test_index_survives_restart(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store("https://a", "body", etag="1")
+    cache.close()
+    cache = HttpCache(str(tmp_path))
+    assert cache.load("https://a") == "body"
+    assert cache.size == 4
+
+
+def test_untracked_bodies_removed_on_restart(tmp_path):
+    cache = HttpCache(str(tmp_path), max_size=100)
+    cache.store("https://a", "x" * 50, etag="1")
+    cache.close()
+    # Stored after the index was saved, then the process died without close().
+    cache.store("https://b", "x" * 50, etag="1")
+    cache = HttpCache(str(tmp_path), max_size=100)
+    assert cache.load("https://b") is None
+    assert cache.load("https://a") == "x" * 50
+    assert {p.name for p in tmp_path.iterdir()} == {'index.json', *cache.entries}
@@ -0,0 +1,66 @@
+import random
+from matcher import KeywordMatcher
+
+# Same as Scraper.description_keyword_map.
+KEYWORD_MAP = {
+    100:(('python'), ('linux', 'unix'), ('junior'), ('1-2 years', '2 years', '1 year')),
+    50:(('network', 'server'), 'data', 'comptia', 'docker', ('tcp', 'dns')),
+    25:(('sql', 'database'), 'git', 'bash', ('security', 'developer', 'QA', 'automation', 'quality', 'test')),
+    10:('c programming', 'english', 'agile', 'jira', 'embedded', ('ubuntu', 'debian')),
+    -100:(('c#', '.net'), 'php', 'javascript', '3+ years', '3 years'),
+    -300:('windows', 'senior', '5+ years', '5 years')
+}
+
+
+def substring_score(keyword_map, description):
+    # Scoring used before KeywordMatcher - one substring search per keyword.
+    score = 0
+    if description:
+        description = description.lower()
+        for points, keywords in keyword_map.items():
+            for keyword in keywords:
+                if isinstance(keyword, tuple):
+                    for k in keyword:
+                        if k in description:
+                            score += points
+                            break
+                else:
+                    if keyword in description:
+                        score += points
+    return score
+
+
+def random_description(rng):
+    words = [t for keywords in KEYWORD_MAP.values() for k in keywords
+        for t in (k if isinstance(k, tuple) else (k,))]
+    words += ['Python', 'DATABASE', 'qa', 'years', 'c', 'net', 'sql', 'lorem', 'ipsum', '2', '3+', '5']
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        word = rng.choice(words)
+        if rng.random() < 0.3:
+            # Fragments and glued words produce overlapping and partial matches.
+            word = word[:rng.randint(1, len(word))]
+        parts.append(word)
+        parts.append(rng.choice([' ', '', '-', '. ', '\n']))
+    return "".join(parts)
+
+
+def test_matches_substring_scoring():
+    rng = random.Random(1)
+    matcher = KeywordMatcher(KEYWORD_MAP)
+    for _ in range(50000):
+        description = random_description(rng)
+        assert matcher.score(description) == substring_score(KEYWORD_MAP, description), description
+
+
+def test_alternatives_score_once():
+    matcher = KeywordMatcher(KEYWORD_MAP)
+    assert matcher.score("linux and unix") == 100
+    assert matcher.score("a database") == 25 + 50
+
+
+def test_empty_description():
+    matcher = KeywordMatcher(KEYWORD_MAP)
+    assert matcher.score("") == 0
+    assert matcher.score(None) == 0
+    assert matcher.score_many(["python", ""]) == [100, 0]
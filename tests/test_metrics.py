@@ -0,0 +1,39 @@
+from metrics import Metrics, summarize
+
+
+def test_summarize_reports_changes_between_snapshots():
+    registry = Metrics()
+    registry.inc('jobs_total', site='a', result='fresh')
+    registry.observe('stage_seconds', 1.0, site='a', stage='fetch')
+    registry.inc('jobs_total', site='b', result='fresh')
+    before = registry.snapshot(site='a')
+    registry.inc('jobs_total', 2, site='a', result='fresh')
+    registry.inc('jobs_total', site='a', result='scraped')
+    registry.observe('stage_seconds', 0.5, site='a', stage='fetch')
+    registry.observe('stage_seconds', 1.5, site='a', stage='fetch')
+    registry.observe('stage_seconds', 2.0, site='b', stage='fetch')
+    lines = summarize(before, registry.snapshot(site='a')).splitlines()
+    assert lines == [
+        "jobs_total result=fresh: 2",
+        "jobs_total result=scraped: 1",
+        "stage_seconds stage=fetch: 2 times, 2.00s total, 1.000s avg",
+    ]
+
+
+def test_unchanged_metrics_are_left_out():
+    registry = Metrics()
+    registry.inc('jobs_total', site='a')
+    registry.observe('stage_seconds', 1.0, site='a')
+    snapshot = registry.snapshot(site='a')
+    assert summarize(snapshot, registry.snapshot(site='a')) == ""
+
+
+def test_prometheus_histogram_buckets_are_cumulative():
+    registry = Metrics()
+    registry.observe('stage_seconds', 0.003, site='a')
+    registry.observe('stage_seconds', 0.02, site='a')
+    text = registry.to_prometheus()
+    assert 'stage_seconds_bucket{site="a",le="0.005"} 1' in text
+    assert 'stage_seconds_bucket{site="a",le="0.025"} 2' in text
+    assert 'stage_seconds_bucket{site="a",le="+Inf"} 2' in text
+    assert 'stage_seconds_count{site="a"} 2' in text
@@ -0,0 +1,81 @@
+"""
+EXPLAIN based checks that hot queries use job_listings indexes. Run against a
+scratch schema of the database given by GETAJOB_TEST_DSN, i.e.
+GETAJOB_TEST_DSN="dbname=postgres user=postgres host=localhost" python -m pytest tests
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import psycopg2.extras
+
+from database import Database
+from scoreboard import Scoreboard
+from urlindex import UrlIndex
+
+DSN = os.environ.get('GETAJOB_TEST_DSN')
+pytestmark = pytest.mark.skipif(not DSN, reason="GETAJOB_TEST_DSN is not set")
+SITES = [f"www.site{i}.lt" for i in range(50)]
+
+
+class RecordingDb:
+    # Stands in for Database - records the request instead of executing it.
+    def __init__(self):
+        self.requests = []
+
+    def add_listener(self, callback):
+        pass
+
+    def request(self, req, params=None, fetch=True, dict_cursor=False):
+        self.requests.append((req, params))
+        return []
+
+
+@pytest.fixture(scope='module')
+def connection():
+    connection = psycopg2.connect(DSN)
+    schema = f"test_{uuid.uuid4().hex}"
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'initDb.sql')) as f:
+        cursor.execute(f.read())
+    connection.commit()
+    db = Database()
+    db.connection, db.cursor = connection, cursor
+    assert db.migrate()
+    now = datetime.now()
+    rows = [(f"https://{SITES[i % len(SITES)]}/job/{i}", 'title', 'company', 0, 0, i % 500 - 250,
+        now - timedelta(minutes=i), SITES[i % len(SITES)]) for i in range(20000)]
+    psycopg2.extras.execute_values(cursor, "INSERT INTO job_listings (url, title, company, "
+        "description_score, distance_score, combined_score, entered, site) VALUES %s", rows)
+    cursor.execute("ANALYZE job_listings;")
+    connection.commit()
+    yield connection
+    cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+    connection.commit()
+    connection.close()
+
+
+def plan(connection, req, params):
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN " + req, params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+
+
+def test_url_index_load_uses_site_index(connection):
+    db = RecordingDb()
+    UrlIndex(db, SITES[0]).load()
+    req, params = db.requests[0]
+    assert 'job_listings_site_entered_idx' in plan(connection, req, params)
+
+
+def test_scoreboard_seed_uses_combined_score_index(connection):
+    db = RecordingDb()
+    Scoreboard(db).seed()
+    req, params = db.requests[0]
+    text = plan(connection, req, params)
+    assert 'job_listings_combined_score_idx' in text
+    assert 'Sort' not in text
+
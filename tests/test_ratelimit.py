@@ -0,0 +1,69 @@
+import asyncio
+import time
+from ratelimit import HostLimiter
+
+
+def test_rate_limits_requests():
+    limiter = HostLimiter('host', rate=20, burst=2)
+
+    async def acquire(count):
+        started = time.monotonic()
+        for _ in range(count):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    # Burst is free, remaining 10 requests take 10 / 20 s.
+    assert 0.4 < asyncio.run(acquire(12)) < 1
+
+
+def test_additive_increase_and_multiplicative_decrease():
+    limiter = HostLimiter('host', rate=2, max_rate=2.5, slow_latency=5)
+    for _ in range(10):
+        limiter.on_success(0.1, 100)
+    assert limiter.rate == 2.5
+    limiter.on_failure()
+    assert limiter.rate == 1.25
+    # Slow responses count as failures.
+    limiter.last_decrease = 0
+    limiter.on_success(10, 100)
+    assert limiter.rate == 0.625
+
+
+def test_decreases_once_per_interval():
+    limiter = HostLimiter('host', rate=4, min_rate=0.5)
+    for _ in range(5):
+        limiter.on_failure()
+    assert limiter.rate == 2
+
+
+def test_rate_stays_above_minimum():
+    limiter = HostLimiter('host', rate=1, min_rate=0.5)
+    for _ in range(5):
+        limiter.last_decrease = 0
+        limiter.on_failure()
+    assert limiter.rate == 0.5
+
+
+def test_retry_after_blocks_host():
+    limiter = HostLimiter('host', rate=100, burst=100)
+    limiter.on_failure(retry_after=0.3)
+    assert limiter.stats['throttled'] == 1
+
+    async def acquire():
+        started = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(acquire()) >= 0.25
+
+
+def test_throughput():
+    limiter = HostLimiter('host')
+    limiter.on_success(0.2, 1000)
+    limiter.on_success(0.4, 1000)
+    limiter.on_failure()
+    stats = limiter.throughput()
+    assert stats['host'] == 'host'
+    assert stats['succeeded'] == 2 and stats['failed'] == 1 and stats['requests'] == 3
+    assert stats['bytes'] == 2000
+    assert abs(stats['avg_latency'] - 0.3) < 1e-9
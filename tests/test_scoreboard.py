@@ -0,0 +1,84 @@
+import random
+from datetime import datetime, timedelta
+from scoreboard import Scoreboard
+
+
+def offer(i, score, entered):
+    return {'title': 't', 'company': 'c', 'description_score': 0, 'distance_score': 0,
+        'combined_score': score, 'url': f"u{i}", 'entered': entered}
+
+
+class FakeDb:
+    # Holds job_listings rows in a dict and answers Scoreboard.seed().
+    def __init__(self, rows):
+        self.rows = rows
+        self.listener = None
+        self.seeds = 0
+
+    def add_listener(self, callback):
+        self.listener = callback
+
+    def request(self, req, params=None, dict_cursor=False):
+        self.seeds += 1
+        return sorted(self.rows.values(), key=lambda r: -r['combined_score'])[:params[0]]
+
+    def write(self, row):
+        self.rows[row['url']] = row
+        self.listener('job_listings', [dict(row)])
+
+
+def expected(rows, since=None):
+    # Same rules as the SQL queries Scoreboard used to run.
+    rows = sorted(rows.values(), key=lambda r: -r['combined_score'])
+    if since:
+        if len(rows) < 30:
+            return []
+        threshold = rows[29]['combined_score']
+        rows = [r for r in rows if r['combined_score'] > threshold and r['entered'] >= since]
+    return [r['combined_score'] for r in rows[:5]]
+
+
+def scores(offers):
+    return [o['combined_score'] for o in offers]
+
+
+def test_matches_database_after_random_writes():
+    rng = random.Random(1)
+    now = datetime.now()
+    db = FakeDb({f"u{i}": offer(i, rng.randint(-300, 300), now - timedelta(days=rng.randint(1, 30)))
+        for i in range(200)})
+    sb = Scoreboard(db)
+    sb.date_of_last_scrape = now - timedelta(hours=1)
+    assert sb.seed()
+    for step in range(3000):
+        i = rng.randint(0, 400)
+        url = f"u{i}"
+        # Updated rows keep their original 'entered' time.
+        entered = db.rows[url]['entered'] if url in db.rows else now
+        db.write(offer(i, rng.randint(-300, 320), entered))
+        if step % 50 == 0:
+            assert scores(sb.top_offers()) == expected(db.rows)
+            assert scores(sb.best_new_offers()) == expected(db.rows, sb.date_of_last_scrape)
+
+
+def test_reseeds_when_top_runs_short():
+    now = datetime.now()
+    db = FakeDb({f"u{i}": offer(i, 100 + i, now) for i in range(100)})
+    sb = Scoreboard(db)
+    sb.seed()
+    # Best offers drop below rows which are not held in memory.
+    for i in range(99, 60, -1):
+        db.write(offer(i, 0, now))
+    assert not sb.seeded
+    assert scores(sb.top_offers()) == expected(db.rows)
+    assert db.seeds == 2
+
+
+def test_no_period_offers_below_30_rows():
+    now = datetime.now()
+    db = FakeDb({f"u{i}": offer(i, i, now) for i in range(10)})
+    sb = Scoreboard(db)
+    sb.date_of_last_scrape = now - timedelta(hours=1)
+    assert sb.best_new_offers() == []
+    assert scores(sb.top_offers()) == [9, 8, 7, 6, 5]
+    assert 'entered' not in sb.top_offers()[0]
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from urlindex import UrlIndex
+
+
+class FakeDb:
+    def __init__(self, rows):
+        self.rows = rows
+        self.listeners = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def request(self, req, params=None):
+        return self.rows
+
+
+def test_is_fresh():
+    now = datetime.now()
+    db = FakeDb([("https://a/1", now - timedelta(days=1)), ("https://a/2", now - timedelta(weeks=3))])
+    index = UrlIndex(db, 'a')
+    index.load()
+    assert index.loaded and len(index) == 2
+    assert index.is_fresh("https://a/1")
+    # Outdated listings are scraped again.
+    assert not index.is_fresh("https://a/2") and index.is_outdated("https://a/2")
+    # Unknown listings are new, not outdated.
+    assert not index.is_fresh("https://a/3") and not index.is_outdated("https://a/3")
+    assert "https://a/2" in index and "https://a/3" not in index
+
+
+def test_failed_load_is_retried():
+    db = FakeDb(None)
+    index = UrlIndex(db, 'a')
+    index.load()
+    assert not index.loaded
+    db.rows = []
+    index.load()
+    assert index.loaded
+
+
+def test_written_rows_of_site_are_added():
+    now = datetime.now()
+    db = FakeDb([("https://a/1", now - timedelta(weeks=3))])
+    index = UrlIndex(db, 'a')
+    index.load()
+    callback, = db.listeners
+    callback('job_listings', [
+        {'url': "https://a/1", 'site': 'a', 'entered': now - timedelta(weeks=3), 'updated': now},
+        {'url': "https://a/2", 'site': 'a', 'entered': now},
+        {'url': "https://b/1", 'site': 'b', 'entered': now}])
+    callback('addresses', [{'name': "Vilnius"}])
+    assert index.is_fresh("https://a/1") and index.is_fresh("https://a/2")
+    assert "https://b/1" not in index
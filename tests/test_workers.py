@@ -0,0 +1,58 @@
+import threading
+import time
+import pytest
+from workers import WorkerPool
+
+
+def test_runs_tasks_and_joins():
+    pool = WorkerPool('test', size=3, queue_size=2)
+    done = []
+    lock = threading.Lock()
+
+    def task(i):
+        time.sleep(0.001)
+        with lock:
+            done.append(i)
+
+    for i in range(50):
+        pool.submit(task, i)
+    pool.join()
+    assert sorted(done) == list(range(50))
+    pool.shutdown()
+
+
+def test_failing_task_does_not_stop_workers():
+    pool = WorkerPool('test', size=1)
+    done = []
+    pool.submit(lambda: 1 / 0)
+    pool.submit(done.append, 1)
+    pool.join()
+    assert done == [1]
+    pool.shutdown()
+
+
+def test_submit_blocks_while_queue_is_full():
+    pool = WorkerPool('test', size=1, queue_size=1)
+    release = threading.Event()
+    pool.submit(release.wait)
+    # Worker is busy - one task fits into the queue, the next one has to wait.
+    pool.submit(lambda: None)
+    submitted = threading.Event()
+    threading.Thread(target=lambda: (pool.submit(lambda: None), submitted.set())).start()
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(1)
+    pool.join()
+    pool.shutdown()
+
+
+def test_shutdown_finishes_queued_tasks_and_stops_threads():
+    pool = WorkerPool('test', size=2)
+    done = []
+    for i in range(10):
+        pool.submit(done.append, i)
+    pool.shutdown()
+    assert len(done) == 10
+    assert not any(t.is_alive() for t in pool.threads)
+    with pytest.raises(RuntimeError):
+        pool.submit(done.append, 10)
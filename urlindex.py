@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+import threading
+from datetime import datetime, timedelta
+from logger import Logger
+
+
+class UrlIndex:
+
+    def __init__(self, db, site, max_age=timedelta(weeks=2)):
+        """
+        Initializes UrlIndex object - in-memory index of job listing urls of a single
+        job site that are already stored in the database, keyed by url. For every url
+        time of the last scrape is kept so that listings older than max_age can be
+        recognised as outdated. Index is loaded once and then kept up to date from
+        rows committed by the database writer.
+        """
+        self.db = db
+        self.site = site
+        self.max_age = max_age
+        self.urls = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.logger = Logger('UrlIndex')
+        self.db.add_listener(self.on_rows_written)
+
+    def load(self):
+        req = "SELECT url, COALESCE(updated, entered) FROM job_listings WHERE site = %s;"
+        rows = self.db.request(req, (self.site,))
+        if rows is None:
+            self.logger.error(f"Unable to load known urls of {self.site}. Will retry on next scrape.")
+            return
+        with self.lock:
+            for url, scraped in rows:
+                # Rows committed while loading may be newer than the ones just read.
+                if url not in self.urls or self.urls[url] < scraped:
+                    self.urls[url] = scraped
+            self.loaded = True
+        self.logger.info(f"Loaded {len(rows)} known urls of {self.site}.")
+
+    def on_rows_written(self, table, rows):
+        if table != 'job_listings':
+            return
+        with self.lock:
+            for row in rows:
+                if row.get('site') == self.site:
+                    self.urls[row['url']] = row.get('updated') or row['entered']
+
+    def is_outdated(self, url, now=None):
+        # Unknown urls are not outdated - they are new.
+        scraped = self.urls.get(url)
+        if scraped is None:
+            return False
+        return scraped < (now or datetime.now()) - self.max_age
+
+    def is_fresh(self, url):
+        # Url is fresh if it is already stored and was scraped recently.
+        return url in self.urls and not self.is_outdated(url)
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
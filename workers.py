@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import threading
+import traceback
+from queue import Queue
+from logger import Logger
+
+
+class WorkerPool:
+
+    def __init__(self, name, size=8, queue_size=50):
+        """
+        Initializes WorkerPool object - fixed number of long-lived worker threads
+        executing tasks from a bounded queue. submit() blocks while the queue is
+        full, so producers can't run ahead of the workers.
+        """
+        self.name = name
+        self.size = size
+        self.tasks = Queue(maxsize=queue_size)
+        self.running = True
+        self.logger = Logger(f"{name} workers")
+        self.threads = [threading.Thread(target=self.__work, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(size)]
+        for t in self.threads:
+            t.start()
+
+    def __work(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    break
+                fn, args = task
+                fn(*args)
+            except Exception:
+                self.logger.error(f"Task failed in {threading.current_thread().name}:\n{traceback.format_exc()}")
+            finally:
+                self.tasks.task_done()
+
+    def submit(self, fn, *args):
+        if not self.running:
+            raise RuntimeError(f"{self.name} worker pool is shut down.")
+        self.tasks.put((fn, args))
+
+    def join(self):
+        # Waits until every submitted task is finished.
+        self.tasks.join()
+
+    def shutdown(self, wait=True):
+        # Lets workers finish queued tasks and stops them.
+        if self.running:
+            self.running = False
+            for t in self.threads:
+                self.tasks.put(None)
+            if wait:
+                for t in self.threads:
+                    t.join()